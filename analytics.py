@@ -0,0 +1,232 @@
+"""Study statistics, updated incrementally from the runs saved since the last update.
+
+    python analytics.py                # update, then print the report
+    python analytics.py update         # only process the new runs and event logs
+    python analytics.py report         # print the report of the last update
+    python analytics.py rebuild        # start over from every run
+
+The aggregates (per player and per music means, reaction time histograms and
+the correlation matrix of Analysis.ipynb) are kept in .analytics_state.json,
+with the id of the last run and the event logs already counted, so an update
+only reads what was saved since. Load them in the notebook with
+analytics.Analytics().
+"""
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+import beat_cache
+from event_log import EVENTS_DIR, load_events
+from results_store import ResultsStore
+
+STATE_FILE = '.analytics_state.json'
+# Reaction time histograms: 50 ms bins up to 3 s, the last bin counts everything above
+HISTOGRAM_BINS = np.append(np.arange(0, 3050, 50), np.inf)
+# Columns of the correlation matrix, the run columns then the music features (as in Analysis.ipynb)
+RUN_FIELDS = {'Score': 'score', 'Average Reaction Time': 'average_reaction_time', 'Total Blocks': 'total_blocks',
+              'Duration': 'duration', 'Just in Time': 'just_in_time', 'Normal': 'normal', 'Too Early': 'too_early',
+              'Up': 'up', 'Down': 'down', 'Left': 'left', 'Right': 'right'}
+MUSIC_FIELDS = ['BPM', 'M_Duration', 'Total Beats']
+CORRELATION_COLUMNS = list(RUN_FIELDS) + MUSIC_FIELDS
+
+
+class RunningCovariance:
+    """Mean and covariance of the rows seen so far, updated a batch at a time (Chan et al. merge)."""
+
+    def __init__(self, size):
+        self.count = 0
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros((size, size))  # Sum of the products of the deviations from the mean
+
+    def update(self, rows):
+        rows = np.asarray(rows, dtype=float)
+        if not len(rows):
+            return
+        batch_mean = rows.mean(axis=0)
+        deviations = rows - batch_mean
+        batch_m2 = deviations.T @ deviations
+        delta = batch_mean - self.mean
+        total = self.count + len(rows)
+        self.m2 += batch_m2 + np.outer(delta, delta) * self.count * len(rows) / total
+        self.mean += delta * len(rows) / total
+        self.count = total
+
+    def correlation(self):
+        if self.count < 2:
+            return np.full_like(self.m2, np.nan)
+        std = np.sqrt(np.diag(self.m2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.m2 / np.outer(std, std)
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean.tolist(), 'm2': self.m2.tolist()}
+
+    @classmethod
+    def from_dict(cls, state):
+        covariance = cls(len(state['mean']))
+        covariance.count = state['count']
+        covariance.mean = np.array(state['mean'])
+        covariance.m2 = np.array(state['m2'])
+        return covariance
+
+
+def new_group():
+    return {'runs': 0, 'score_sum': 0, 'reaction_time_sum': 0.0, 'reaction_time_runs': 0,
+            'reaction_times': [0] * (len(HISTOGRAM_BINS) - 1)}
+
+
+def parse_bpm(bpm):
+    # music_info.csv written by older versions keeps the BPM as '[140.625]'
+    return float(str(bpm).strip('[] '))
+
+
+class Analytics:
+    def __init__(self, state_file=STATE_FILE, music_folder='musics', music_info_file='music_info.csv'):
+        self.state_file = state_file
+        self.music_folder = music_folder
+        self.music_info_file = music_info_file
+        self.reset()
+        if os.path.isfile(state_file):
+            with open(state_file) as file:
+                state = json.load(file)
+            self.last_run_id = state['last_run_id']
+            self.event_files = set(state['event_files'])
+            self.players = state['players']
+            self.musics = state['musics']
+            self.music_features = state['music_features']
+            self.average_reaction_times = state['average_reaction_times']
+            self.covariance = RunningCovariance.from_dict(state['covariance'])
+
+    def reset(self):
+        self.last_run_id = 0
+        self.event_files = set()
+        self.players = {}
+        self.musics = {}
+        self.music_features = {}  # Music name -> features (None if the music could not be found)
+        self.average_reaction_times = [0] * (len(HISTOGRAM_BINS) - 1)
+        self.covariance = RunningCovariance(len(CORRELATION_COLUMNS))
+
+    def save(self):
+        state = {
+            'last_run_id': self.last_run_id,
+            'event_files': sorted(self.event_files),
+            'players': self.players,
+            'musics': self.musics,
+            'music_features': self.music_features,
+            'average_reaction_times': self.average_reaction_times,
+            'covariance': self.covariance.to_dict(),
+        }
+        # Written next to the old state and renamed, an interrupted update keeps the old one
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump(state, file)
+        os.replace(tmp_file, self.state_file)
+
+    def features_of(self, music):
+        """Features of a music: from the beat cache, else music_info.csv, else analysed (and cached) once."""
+        if music not in self.music_features:
+            features = None
+            music_file = os.path.join(self.music_folder, music)
+            if os.path.isfile(music_file):
+                features = beat_cache.load_features(music_file)
+            if features is None and os.path.isfile(self.music_info_file):
+                with open(self.music_info_file, newline='') as file:
+                    features = next((row for row in csv.DictReader(file) if row['Music'] == music), None)
+            if features is None and os.path.isfile(music_file):
+                import music_analysis  # Slow to import, only needed for a music never analysed
+                features = music_analysis.analyze_track(music_file)
+            if features is not None:
+                features = {'BPM': parse_bpm(features['BPM']), 'M_Duration': float(features['M_Duration']),
+                            'Total Beats': int(features['Total Beats'])}
+            self.music_features[music] = features
+        return self.music_features[music]
+
+    def update(self, results):
+        """Add the runs saved in the results store and the event logs written since the last update."""
+        new_runs = results.runs_since(self.last_run_id)
+        rows = []
+        for run_id, run in new_runs:
+            self.last_run_id = max(self.last_run_id, run_id)
+            for groups, key in ((self.players, run['name']), (self.musics, run['music'])):
+                group = groups.setdefault(key or '', new_group())
+                group['runs'] += 1
+                group['score_sum'] += run['score']
+                if run['average_reaction_time']:
+                    group['reaction_time_sum'] += run['average_reaction_time']
+                    group['reaction_time_runs'] += 1
+            if run['average_reaction_time']:
+                index = np.searchsorted(HISTOGRAM_BINS, run['average_reaction_time'], side='right') - 1
+                self.average_reaction_times[index] += 1
+            # Only the runs with every column go into the correlations (the old leaderboard rows only have a score)
+            features = self.features_of(run['music']) if run['music'] else None
+            values = [run[field] for field in RUN_FIELDS.values()]
+            if features is not None and None not in values:
+                rows.append(values + [features[field] for field in MUSIC_FIELDS])
+        self.covariance.update(rows)
+        new_events = self.update_events()
+        self.save()
+        return len(new_runs), new_events
+
+    def update_events(self):
+        # Histograms of the reaction time of every zombie killed, from the event logs not counted yet
+        if not os.path.isdir(EVENTS_DIR):
+            return 0
+        new_files = sorted(f for f in os.listdir(EVENTS_DIR)
+                           if f.endswith(('.parquet', '.npz')) and f not in self.event_files)
+        if not new_files:
+            return 0
+        events = load_events(EVENTS_DIR, new_files)
+        hits = events['kind'] == 'hit'
+        for groups, column in ((self.players, 'name'), (self.musics, 'music')):
+            keys = events[column][hits]
+            reaction_times = events['reaction_time'][hits]
+            for key in np.unique(keys):
+                counts, _ = np.histogram(reaction_times[keys == key], HISTOGRAM_BINS)
+                group = groups.setdefault(key, new_group())
+                group['reaction_times'] = (np.array(group['reaction_times']) + counts).tolist()
+        self.event_files.update(new_files)
+        return len(new_files)
+
+    def means(self, groups):
+        # (key, runs, mean score, mean of the average reaction times) sorted by mean score
+        rows = [(key, group['runs'], group['score_sum'] / group['runs'] if group['runs'] else 0.0,
+                 group['reaction_time_sum'] / group['reaction_time_runs'] if group['reaction_time_runs'] else 0.0)
+                for key, group in groups.items()]
+        return sorted(rows, key=lambda row: -row[2])
+
+    def report(self):
+        print("Score moyen par joueur")
+        for name, runs, score, reaction_time in self.means(self.players):
+            print(f"  {name:20} {runs:5} runs  {score:8.1f}  {reaction_time:7.1f} ms")
+        print("Score moyen par musique")
+        for music, runs, score, reaction_time in self.means(self.musics):
+            print(f"  {music:20} {runs:5} runs  {score:8.1f}  {reaction_time:7.1f} ms")
+        print(f"Corrélations ({self.covariance.count} runs)")
+        labels = [column[:6] for column in CORRELATION_COLUMNS]
+        print(" " * 22 + " ".join(f"{label:>6}" for label in labels))
+        for column, row in zip(CORRELATION_COLUMNS, self.covariance.correlation()):
+            print(f"  {column:20}" + " ".join(f"{value:6.2f}" for value in row))
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'all'
+    if command not in ('all', 'update', 'report', 'rebuild'):
+        print(__doc__)
+        return
+    analytics = Analytics()
+    if command == 'rebuild':
+        analytics.reset()
+    if command != 'report':
+        results = ResultsStore()
+        runs, event_files = analytics.update(results)
+        results.close()
+        print(runs, "new runs,", event_files, "new event logs")
+    if command != 'update':
+        analytics.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""Asset bundles: the sprites and the background baked at the exact size the game draws them.
+
+    python asset_bundle.py                 # build (or update) the bundle of every tier
+    python asset_bundle.py 1x 2x           # only some tiers
+    python asset_bundle.py --force         # rebuild everything
+
+Each tier is one file, assets/<tier>.bundle: a JSON manifest followed by the
+RGBA pixels of a sprite atlas and the RGB pixels of the background, so the
+game loads everything with a single read and nothing to decode or scale.
+The background is rasterised from lJRBNZ.svg when cairosvg is installed
+(background.png otherwise). Only the sprites whose source, size or angle
+changed since the last build are rendered again.
+"""
+import hashlib
+import io
+import json
+import os
+import struct
+import sys
+import xml.etree.ElementTree as ElementTree
+
+import pygame
+
+import sprite_cache
+
+# --- Configuration ---
+
+BUNDLE_DIR = 'assets'
+# Resolution tiers, as a scale of the 800x600 game window
+TIERS = {'1x': 1.0, '1.5x': 1.5, '2x': 2.0}
+BUNDLE_VERSION = 1
+# Start of every bundle, followed by the length of the manifest
+MAGIC = b'RGBUNDLE'
+HEADER = struct.Struct('<8sI')
+# Offset of the background image from the center of the screen, at 1x
+BACKGROUND_OFFSET = (20, -30)
+
+# Bundles already loaded in this process (station mode), keyed by tier
+_loaded_bundles = {}
+
+
+def bundle_path(tier, folder=BUNDLE_DIR):
+    return os.path.join(folder, f"{tier}.bundle")
+
+
+def background_layout(image_size, screen_size, scale=1.0):
+    """Size and position of the background image: it covers the whole screen, slightly off center."""
+    image_width, image_height = image_size
+    screen_width, screen_height = screen_size
+    scale_ratio = max(screen_width / image_width, screen_height / image_height)
+    new_width = int(image_width * scale_ratio)
+    new_height = int(image_height * scale_ratio)
+    x_position = (screen_width - new_width) // 2 + round(BACKGROUND_OFFSET[0] * scale)
+    y_position = (screen_height - new_height) // 2 + round(BACKGROUND_OFFSET[1] * scale)
+    return (new_width, new_height), (x_position, y_position)
+
+
+def read_bundle(path):
+    """Return (manifest, data) of a bundle file, data being the whole file, or None."""
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+        magic, manifest_length = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            return None
+        manifest = json.loads(data[HEADER.size:HEADER.size + manifest_length])
+    except (FileNotFoundError, OSError, struct.error, ValueError):
+        return None
+    if manifest.get('version') != BUNDLE_VERSION:
+        return None
+    return manifest, data
+
+
+def is_stale(manifest):
+    # Sources edited since the build (their mtime or size changed), a few stat calls
+    for path, (mtime_ns, size) in manifest['sources'].items():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return True
+        if (stat.st_mtime_ns, stat.st_size) != (mtime_ns, size):
+            return True
+    return False
+
+
+def bundle_surfaces(manifest, data):
+    # The surfaces are read straight from the bytes of the file (frombuffer doesn't copy)
+    view = memoryview(data)
+    atlas = manifest['atlas']
+    atlas_surface = pygame.image.frombuffer(view[atlas['offset']:atlas['offset'] + atlas['length']],
+                                            tuple(atlas['size']), 'RGBA')
+    background = manifest['background']
+    background_surface = pygame.image.frombuffer(
+        view[background['offset']:background['offset'] + background['length']], tuple(background['size']), 'RGB')
+    return atlas_surface, background_surface
+
+
+def load_bundle(tier, folder=BUNDLE_DIR):
+    """Return ({sprite name: surface}, background surface) of a tier, or None if it isn't built or is out of date."""
+    if tier in _loaded_bundles:
+        return _loaded_bundles[tier]
+    bundle = read_bundle(bundle_path(tier, folder))
+    if bundle is None:
+        return None
+    manifest, data = bundle
+    if is_stale(manifest):
+        print(f"The {tier} asset bundle is out of date, run 'python asset_bundle.py' to rebuild it")
+        return None
+    atlas, background = bundle_surfaces(manifest, data)
+    atlas = atlas.convert_alpha()
+    sprites = {name: atlas.subsurface(sprite['rect']) for name, sprite in manifest['sprites'].items()}
+    _loaded_bundles[tier] = sprites, background.convert()
+    return _loaded_bundles[tier]
+
+
+def content_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        digest.update(file.read())
+    return digest.hexdigest()
+
+
+def svg_size(svg_file):
+    # Size of the SVG drawing in pixels, from its width/height attributes or its viewBox
+    root = ElementTree.parse(svg_file).getroot()
+    try:
+        return float(root.get('width').removesuffix('px')), float(root.get('height').removesuffix('px'))
+    except (AttributeError, ValueError):
+        _, _, width, height = (float(value) for value in root.get('viewBox').replace(',', ' ').split())
+        return width, height
+
+
+def render_background(source, screen_size, scale):
+    """The whole screen background: black, with the source image covering it."""
+    background = pygame.Surface(screen_size)
+    background.fill((0, 0, 0))
+    if source.endswith('.svg'):
+        # Rasterised directly at its final size, nothing is scaled
+        from getpng_joeg import svg_to_png_bytes
+        size, position = background_layout(svg_size(source), screen_size, scale)
+        image = pygame.image.load(io.BytesIO(svg_to_png_bytes(source, *size)), 'background.png')
+    else:
+        image = pygame.image.load(source)
+        size, position = background_layout(image.get_size(), screen_size, scale)
+        image = pygame.transform.scale(image, size)
+    background.blit(image, position)
+    return background
+
+
+def background_source(svg_file='lJRBNZ.svg', png_file='background.png'):
+    # The SVG gives a sharp background at every tier, but needs cairosvg
+    try:
+        import getpng_joeg  # noqa: F401 (imports cairosvg)
+    except (ImportError, OSError):
+        return png_file
+    return svg_file if os.path.isfile(svg_file) else png_file
+
+
+def build_bundle(tier, specs, screen_size, background_file, folder=BUNDLE_DIR, force=False):
+    """Build the bundle of a tier, reusing what didn't change in the previous one. Returns the sprites rendered.
+
+    specs: (name, path, size, angles) of every sprite at 1x, screen_size: size of the screen at 1x.
+    Returns None if the bundle was already up to date.
+    """
+    scale = TIERS[tier]
+    path = bundle_path(tier, folder)
+    previous = None if force else read_bundle(path)
+    previous_sprites = {}
+    previous_background = None
+    if previous is not None:
+        manifest, data = previous
+        atlas, background = bundle_surfaces(manifest, data)
+        previous_sprites = {name: (sprite['key'], atlas.subsurface(sprite['rect']))
+                            for name, sprite in manifest['sprites'].items()}
+        previous_background = manifest['background']['key'], background
+
+    sources = {}
+    sprites = {}
+    keys = {}
+    rendered = []
+    for name, source, size, angles in specs:
+        sources[source] = content_hash(source)
+        scaled_size = (round(size[0] * scale), round(size[1] * scale))
+        for angle in angles:
+            sprite = sprite_cache.sprite_name(name, angle)
+            keys[sprite] = hashlib.sha1(repr((sources[source], scaled_size, angle)).encode()).hexdigest()
+            if sprite in previous_sprites and previous_sprites[sprite][0] == keys[sprite]:
+                sprites[sprite] = previous_sprites[sprite][1]
+            else:
+                sprites[sprite] = sprite_cache.render_sprites([(name, source, scaled_size, [angle])])[sprite]
+                rendered.append(sprite)
+
+    screen_size = (round(screen_size[0] * scale), round(screen_size[1] * scale))
+    sources[background_file] = content_hash(background_file)
+    background_key = hashlib.sha1(repr((sources[background_file], screen_size, scale)).encode()).hexdigest()
+    if previous_background is not None and previous_background[0] == background_key:
+        background = previous_background[1]
+    else:
+        background = render_background(background_file, screen_size, scale)
+        rendered.append('background')
+
+    # What the game checks to warn about an out of date bundle
+    source_stats = {source: [os.stat(source).st_mtime_ns, os.stat(source).st_size] for source in sources}
+    if (previous is not None and not rendered and list(sprites) == list(previous_sprites)
+            and source_stats == previous[0]['sources']):
+        return None
+    atlas, rects = sprite_cache.pack_atlas(sprites)
+    atlas_bytes = pygame.image.tobytes(atlas, 'RGBA')
+    background_bytes = pygame.image.tobytes(background, 'RGB')
+    manifest = {
+        'version': BUNDLE_VERSION,
+        'tier': tier,
+        'scale': scale,
+        'sprites': {name: {'rect': list(rects[name]), 'key': keys[name]} for name in sprites},
+        'background': {'size': list(background.get_size()), 'key': background_key, 'length': len(background_bytes)},
+        'atlas': {'size': list(atlas.get_size()), 'length': len(atlas_bytes)},
+        'sources': source_stats,
+    }
+    # The offsets depend on the length of the manifest, which depends on the offsets: give them a fixed width
+    manifest['atlas']['offset'] = manifest['background']['offset'] = 10 ** 12
+    manifest_length = len(json.dumps(manifest).encode())
+    manifest['atlas']['offset'] = HEADER.size + manifest_length
+    manifest['background']['offset'] = manifest['atlas']['offset'] + len(atlas_bytes)
+    manifest_bytes = json.dumps(manifest).encode().ljust(manifest_length)
+
+    os.makedirs(folder, exist_ok=True)
+    with open(path + '.tmp', 'wb') as file:
+        file.write(HEADER.pack(MAGIC, manifest_length))
+        file.write(manifest_bytes)
+        file.write(atlas_bytes)
+        file.write(background_bytes)
+    os.replace(path + '.tmp', path)
+    _loaded_bundles.pop(tier, None)
+    return rendered
+
+
+def main():
+    args = sys.argv[1:]
+    force = '--force' in args
+    tiers = [arg for arg in args if arg != '--force'] or list(TIERS)
+    for tier in tiers:
+        if tier not in TIERS:
+            print(__doc__)
+            return
+    # The sprites are rendered without a window
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    import test12  # The sprites and sizes the game draws
+    specs = test12.sprite_specs()
+    background_file = background_source()
+    for tier in tiers:
+        rendered = build_bundle(tier, specs, (test12.WIDTH, test12.HEIGHT), background_file, force=force)
+        if rendered is None:
+            print(f"{tier}: up to date")
+        else:
+            print(f"{tier}: {len(rendered)} images rendered, {os.path.getsize(bundle_path(tier))} bytes")
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pygame
+
+import beat_cache
+
+# --- Configuration ---
+
+# Folder holding the decoded tracks, one .npy file of 16 bit PCM samples per track
+CACHE_DIR = '.audio_cache'
+# Total size allowed for the cache folder (a 3 minute track takes about 32 MB)
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+# Decoded tracks kept in memory as pygame Sounds, least recently played first out
+MAX_LOADED_BYTES = 160 * 1024 * 1024
+# Mixer format the tracks are decoded to (init_pygame asks the mixer for it)
+FREQUENCY = 44100
+CHANNELS = 2
+
+
+def pcm_path(music_file, frequency=FREQUENCY, channels=CHANNELS):
+    return os.path.join(CACHE_DIR, f"{beat_cache.file_hash(music_file)}_{frequency}_{channels}.npy")
+
+
+def load_pcm(music_file, frequency=FREQUENCY, channels=CHANNELS):
+    """Return the decoded samples of a track (memory-mapped int16 array of shape (frames, channels)), or None."""
+    path = pcm_path(music_file, frequency, channels)
+    try:
+        samples = np.load(path, mmap_mode='r')
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+    # Refresh the access time used by the eviction
+    os.utime(path)
+    return samples
+
+
+def store_pcm(music_file, samples, frequency=FREQUENCY, channels=CHANNELS):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = pcm_path(music_file, frequency, channels)
+    # Write to a temporary file first so a crash never leaves a truncated track
+    # (the game and the analysis processes may decode the same track at the same time)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as file:
+        np.save(file, np.ascontiguousarray(samples, dtype=np.int16).reshape(-1, channels))
+    os.replace(temp_path, path)
+    beat_cache.evict(keep=path, max_bytes=MAX_CACHE_BYTES, folder=CACHE_DIR)
+    return load_pcm(music_file, frequency, channels)
+
+
+def decode(music_file, frequency=FREQUENCY, channels=CHANNELS):
+    """Decoded samples of a track, from the cache or decoded with librosa (works without a mixer)."""
+    samples = load_pcm(music_file, frequency, channels)
+    if samples is None:
+        import librosa  # Slow to import, the game only needs it when the track was never decoded
+        y, _ = librosa.load(music_file, sr=frequency, mono=channels == 1, dtype=np.float32)
+        y = np.atleast_2d(y)
+        if len(y) != channels:
+            y = np.repeat(y.mean(axis=0, keepdims=True), channels, axis=0)
+        samples = store_pcm(music_file, (np.clip(y.T, -1, 1) * 32767).astype(np.int16), frequency, channels)
+    return samples
+
+
+class CachedMusic:
+    """Stand-in for pygame.mixer.music that plays the decoded tracks of the audio cache.
+
+    The track is loaded in a pygame Sound and played in a loop by the mixer, so
+    there is no gap and nothing to decode when it starts again. prepare() loads
+    it in a background thread (a track never played takes about a second to
+    decode), the game shows its loading screen until ready(). get_pos() counts
+    the ms played since play() over all the loops (like pygame.mixer.music with
+    loops=-1), get_length() gives the length of one loop.
+    """
+
+    def __init__(self):
+        self.sounds = OrderedDict()  # music file -> Sound, most recently played last
+        self.decoding = {}  # music file -> thread loading its Sound
+        self.decoded = {}  # music file -> Sound loaded by the thread (None if it failed)
+        self.sound = None
+        self.channel = None
+        self.start = None
+        self.paused_at = None
+
+    def prepare(self, music_file):
+        """Start loading the Sound of a track in a background thread, unless it is already in memory."""
+        if music_file in self.sounds or music_file in self.decoding:
+            return
+        frequency, _, channels = pygame.mixer.get_init()
+        thread = threading.Thread(target=self.load_sound, args=(music_file, frequency, channels), daemon=True)
+        self.decoding[music_file] = thread
+        thread.start()
+
+    def load_sound(self, music_file, frequency, channels):
+        try:
+            self.decoded[music_file] = pygame.mixer.Sound(buffer=decode(music_file, frequency, channels))
+        except Exception as error:
+            # get_sound() will try the decoder of the mixer instead
+            print("Could not decode", music_file, ":", error)
+            self.decoded[music_file] = None
+
+    def ready(self, music_file):
+        # True when load() won't have to wait (a track never prepared is loaded by load() itself)
+        return music_file in self.sounds or music_file in self.decoded or music_file not in self.decoding
+
+    def get_sound(self, music_file):
+        if music_file in self.sounds:
+            self.sounds.move_to_end(music_file)
+            return self.sounds[music_file]
+        frequency, _, channels = pygame.mixer.get_init()
+        thread = self.decoding.pop(music_file, None)
+        if thread is not None:
+            # Only waits when the track is loaded before being ready
+            thread.join()
+        sound = self.decoded.pop(music_file, None)
+        if sound is None:
+            samples = load_pcm(music_file, frequency, channels)
+            if samples is None:
+                # First play of this track: decode it with the mixer and keep the samples for the next times
+                sound = pygame.mixer.Sound(music_file)
+                store_pcm(music_file, np.frombuffer(sound.get_raw(), dtype=np.int16), frequency, channels)
+            else:
+                sound = pygame.mixer.Sound(buffer=samples)
+        self.sounds[music_file] = sound
+        # Forget the least recently played tracks beyond the memory limit
+        sizes = [sound.get_length() * frequency * channels * 2 for sound in self.sounds.values()]
+        while sum(sizes) > MAX_LOADED_BYTES and len(self.sounds) > 1:
+            self.sounds.popitem(last=False)
+            sizes.pop(0)
+        return sound
+
+    def load(self, music_file):
+        self.stop()
+        self.sound = self.get_sound(music_file)
+
+    def play(self):
+        self.stop()
+        self.channel = self.sound.play(loops=-1)
+        self.start = time.perf_counter()
+        self.paused_at = None
+
+    def stop(self):
+        if self.channel is not None:
+            self.channel.stop()
+        self.channel = None
+        self.start = None
+
+    def pause(self):
+        if self.channel is not None and self.paused_at is None:
+            self.channel.pause()
+            self.paused_at = time.perf_counter()
+
+    def unpause(self):
+        if self.paused_at is not None:
+            self.channel.unpause()
+            self.start += time.perf_counter() - self.paused_at
+            self.paused_at = None
+
+    def get_sample_pos(self):
+        """Number of samples (per channel) played since play(), -1 when stopped."""
+        if self.start is None:
+            return -1
+        now = self.paused_at if self.paused_at is not None else time.perf_counter()
+        return int((now - self.start) * pygame.mixer.get_init()[0])
+
+    def get_pos(self):
+        samples = self.get_sample_pos()
+        return samples if samples < 0 else samples * 1000 // pygame.mixer.get_init()[0]
+
+    def get_length(self):
+        # Length of one loop (ms), exact to the sample
+        return self.sound.get_length() * 1000 if self.sound is not None else 0.0
+
+    def get_busy(self):
+        return self.channel is not None and (self.paused_at is not None or self.channel.get_busy())
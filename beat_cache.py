@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+from importlib import metadata
+
+import numpy as np
+
+# --- Configuration ---
+
+# Folder holding one .npy beat map (and one .json of music info) per analysed track
+CACHE_DIR = '.beat_cache'
+# Total size allowed for the cache folder, oldest entries are evicted first
+MAX_CACHE_BYTES = 20 * 1024 * 1024
+# Parameters of music_analysis.extract_music_features, part of the cache key so a
+# change of analysis settings never serves stale beat maps
+ANALYSIS_PARAMS = {'sr': 22050, 'hop_length': 512}
+# One row per beat in the beat maps, np.load(path, mmap_mode='r') reads them without copying
+BEAT_DTYPE = np.dtype([
+    ('time', np.int32),  # ms from the start of the track
+    ('strength', np.float32),  # Onset strength at the beat, 1 for the strongest beat of the track
+    ('energy', np.float32),  # Mean RMS energy until the next beat
+    ('downbeat', np.bool_),  # First beat of a bar (estimated, 4 beats per bar)
+])
+
+
+def librosa_version():
+    try:
+        return metadata.version('librosa')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+# Hashes already computed in this process, keyed by (path, mtime, size)
+_hash_memo = {}
+
+
+def file_hash(path):
+    """Hash of the audio content, so a renamed file keeps its cache and an edited one loses it."""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if memo_key in _hash_memo:
+        return _hash_memo[memo_key]
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    _hash_memo[memo_key] = digest.hexdigest()
+    return _hash_memo[memo_key]
+
+
+def cache_key(music_file):
+    digest = hashlib.sha1(file_hash(music_file).encode())
+    digest.update(librosa_version().encode())
+    digest.update(repr(sorted(ANALYSIS_PARAMS.items())).encode())
+    # The analysis starts from the samples decoded for the game, in the format of the audio cache
+    import audio_cache  # Not at the top, audio_cache imports this module
+    digest.update(repr((audio_cache.FREQUENCY, audio_cache.CHANNELS, 'int16')).encode())
+    return digest.hexdigest()
+
+
+def cache_path(music_file, extension='.npy'):
+    return os.path.join(CACHE_DIR, cache_key(music_file) + extension)
+
+
+def load_beat_features(music_file):
+    """Return the cached beat map of a track (memory-mapped array of BEAT_DTYPE rows), or None."""
+    path = cache_path(music_file)
+    try:
+        beats = np.load(path, mmap_mode='r')
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+    if beats.dtype != BEAT_DTYPE:
+        return None
+    # Refresh the access time used by the eviction
+    os.utime(path)
+    return beats
+
+
+def load_beats(music_file):
+    """Return the cached beat timestamps (in ms) of a track, or None if it was never analysed."""
+    beats = load_beat_features(music_file)
+    return None if beats is None else beats['time'].tolist()
+
+
+def store_beats(music_file, beats):
+    # beats: array of BEAT_DTYPE rows
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = cache_path(music_file)
+    # Write to a temporary file first so a crash never leaves a truncated beat map
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        np.save(file, np.asarray(beats, dtype=BEAT_DTYPE))
+    os.replace(temp_path, path)
+    evict(keep=path)
+
+
+def load_features(music_file):
+    """Return the cached music info (BPM, loudness, duration...) of a track, or None."""
+    path = cache_path(music_file, '.json')
+    try:
+        with open(path) as file:
+            features = json.load(file)
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+    os.utime(path)
+    return features
+
+
+def store_features(music_file, features):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = cache_path(music_file, '.json')
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(features, file)
+    os.replace(temp_path, path)
+    evict(keep=path)
+
+
+def evict(keep=None, max_bytes=MAX_CACHE_BYTES, folder=CACHE_DIR):
+    # Remove the least recently used beat maps until the cache fits in max_bytes
+    if not os.path.isdir(folder):
+        return
+    entries = []
+    for filename in os.listdir(folder):
+        path = os.path.join(folder, filename)
+        if filename.endswith(('.npy', '.json')) and os.path.isfile(path):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        os.remove(path)
+        total -= size
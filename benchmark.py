@@ -0,0 +1,125 @@
+"""Benchmark of the game loop, run headless on the beat maps of the bundled musics.
+
+    python benchmark.py                   # print the results
+    python benchmark.py --save-baseline   # remember them as the reference of this machine
+    python benchmark.py --check           # exit with an error if a scenario got slower than the reference
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import beat_cache
+import headless
+from instrumentation import PHASES
+
+BASELINE_FILE = '.benchmark_baseline.json'
+SPEED_MULTIPLIERS = [1.0, 2.0, 3.0]
+# Number of enemies spawned per beat of the music
+DENSITIES = [1, 4, 16]
+# Distance (pixels) at which the bot defends, far enough to survive the fastest scenario
+BOT_REACH = 100
+
+
+def load_beat_maps(music_folder='musics', synthetic=False):
+    # One beat map per music, analysed (and cached) if needed
+    if synthetic:
+        return {'synthetic_128bpm': list(range(0, 120000, 469))}
+    beat_maps = {}
+    for music in sorted(f for f in os.listdir(music_folder) if f.endswith('.mp3')):
+        music_file = os.path.join(music_folder, music)
+        beats = beat_cache.load_beats(music_file)
+        if beats is None:
+            import music_analysis  # Only needed (and slow to import) when a music was never analysed
+            print("Analysing", music, "...")
+            music_analysis.analyze_track(music_file)
+            beats = beat_cache.load_beats(music_file)
+        beat_maps[music] = beats
+    return beat_maps
+
+
+def densify(beat_timestamps, density):
+    # Add density - 1 evenly spaced spawns between two beats
+    if density == 1 or len(beat_timestamps) < 2:
+        return list(beat_timestamps)
+    beats = np.asarray(beat_timestamps, dtype=float)
+    steps = np.arange(density) / density
+    spawns = beats[:-1, None] + np.diff(beats)[:, None] * steps
+    return [int(t) for t in spawns.ravel()] + [int(beats[-1])]
+
+
+def run_scenario(beat_timestamps, speed_multiplier, frames, seed=0):
+    duration_ms = beat_timestamps[-1] + 2000
+    game = headless.make_headless_game(duration_ms, seed=seed, bot=headless.defend_bot(BOT_REACH))
+    start = time.perf_counter()
+    played = headless.run_headless(game, beat_timestamps, frames, speed_multiplier)
+    elapsed = time.perf_counter() - start
+    score = game.score
+    frame_times = game.stats.ordered(game.stats.frames, game.stats.frame_count)[:, 1:]
+    phase_times = frame_times.mean(axis=0)
+
+    # Allocations measured on a shorter second run, tracemalloc slows everything down
+    game = headless.make_headless_game(duration_ms, seed=seed, bot=headless.defend_bot(BOT_REACH))
+    tracemalloc.start()
+    headless.run_headless(game, beat_timestamps, min(frames, 300), speed_multiplier)
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'frames': played,
+        # The median frame time is much less noisy than the average to compare two runs
+        'fps': 1000 / max(float(np.median(frame_times.sum(axis=1))), 1e-6),
+        'average_fps': played / elapsed,
+        'phases_ms': dict(zip(PHASES, (round(float(t), 4) for t in phase_times))),
+        'score': score,
+        'allocated_kib': allocated / 1024,
+        'peak_kib': peak / 1024,
+        'enemy_slots': len(game.enemies.x),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=1800, help='frames per scenario (default: 1800, 30 s of game)')
+    parser.add_argument('--synthetic', action='store_true', help='use a generated 128 BPM beat map instead of the musics')
+    parser.add_argument('--save-baseline', action='store_true', help=f'save the results in {BASELINE_FILE}')
+    parser.add_argument('--check', action='store_true', help='fail if a scenario is slower than the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='accepted FPS loss for --check (default: 0.25)')
+    args = parser.parse_args()
+    if args.check and not os.path.isfile(BASELINE_FILE):
+        print(f"No baseline to check against, run 'python benchmark.py --save-baseline' first ({BASELINE_FILE} not found)")
+        sys.exit(2)
+
+    results = {}
+    for music, beats in load_beat_maps(synthetic=args.synthetic).items():
+        for speed_multiplier in SPEED_MULTIPLIERS:
+            for density in DENSITIES:
+                name = f"{music} x{speed_multiplier} speed {density} per beat"
+                result = run_scenario(densify(beats, density), speed_multiplier, args.frames)
+                results[name] = result
+                phases = "  ".join(f"{phase} {ms:.3f}" for phase, ms in result['phases_ms'].items() if phase != 'idle')
+                print(f"{name:55} {result['fps']:8.0f} FPS  {result['frames']:5} frames  "
+                      f"{phases}  peak {result['peak_kib']:.0f} KiB")
+
+    if args.save_baseline:
+        with open(BASELINE_FILE, 'w') as file:
+            json.dump(results, file, indent=1)
+        print("Baseline saved in", BASELINE_FILE)
+
+    if args.check:
+        with open(BASELINE_FILE) as file:
+            baseline = json.load(file)
+        regressions = [name for name, result in results.items()
+                       if name in baseline and result['fps'] < baseline[name]['fps'] * (1 - args.tolerance)]
+        for name in regressions:
+            print(f"REGRESSION {name}: {results[name]['fps']:.0f} FPS (baseline {baseline[name]['fps']:.0f})")
+        if regressions:
+            sys.exit(1)
+        print("No performance regression")
+
+
+if __name__ == '__main__':
+    main()
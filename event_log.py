@@ -0,0 +1,113 @@
+"""Per-event log of the runs: every zombie killed or missed and every defense that hit nothing.
+
+The events of each run are exported to events/<session id>.parquet, load all
+of them at once in the notebook with pd.read_parquet('events'). Without
+pyarrow they are saved as events/<session id>.npz instead;
+pd.DataFrame(load_events()) reads both kinds of files.
+"""
+import os
+
+import numpy as np
+
+EVENTS_DIR = 'events'
+# hit: zombie killed, miss: zombie that reached the player, whiff: defense that killed nothing
+EVENT_KINDS = ['hit', 'miss', 'whiff']
+EVENT_DTYPE = np.dtype([
+    ('time', np.float64),  # Game time (ms)
+    ('kind', np.int8),  # Index in EVENT_KINDS
+    ('beat', np.int32),  # Index of the zombie's beat in the beat map (-1 if unknown)
+    ('direction', np.int8),  # Index in DIRECTIONS
+    ('distance', np.float32),  # Distance of the zombie (of the closest one in that direction for a whiff)
+    ('reaction_time', np.float32),  # Time since the zombie spawned (ms)
+    ('speed_multiplier', np.float32),
+])
+
+
+class EventLog:
+    """Events of a run in a preallocated structured array, doubled when full."""
+
+    def __init__(self, capacity=4096):
+        self.events = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self.count = 0
+
+    def clear(self):
+        self.count = 0
+
+    def record(self, kind, time, beats, directions, distances, reaction_times, speed_multiplier):
+        # One event per element of beats, the other arguments are arrays of the same length or scalars
+        count = len(beats)
+        if self.count + count > len(self.events):
+            self.events = np.concatenate([self.events, np.zeros(max(len(self.events), count), dtype=EVENT_DTYPE)])
+        rows = self.events[self.count:self.count + count]
+        rows['time'] = time
+        rows['kind'] = EVENT_KINDS.index(kind)
+        rows['beat'] = beats
+        rows['direction'] = directions
+        rows['distance'] = distances
+        rows['reaction_time'] = reaction_times
+        rows['speed_multiplier'] = speed_multiplier
+        self.count += count
+
+    def snapshot(self):
+        # Copy of the events of the run, saved by the journal thread
+        return self.events[:self.count].copy()
+
+
+def save_events(path, events, session_id, name, music, directions):
+    """Save the events of a run to path + '.parquet' (or '.npz' without pyarrow)."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        np.savez_compressed(path + '.npz', events=events, session_id=session_id, name=name, music=music,
+                            kinds=np.array(EVENT_KINDS), directions=np.array(directions))
+        return
+    count = len(events)
+    # The run columns are constant and the codes are dictionary encoded, they cost almost nothing
+    table = pa.table({
+        'session_id': pa.DictionaryArray.from_arrays(np.zeros(count, dtype=np.int8), [session_id]),
+        'name': pa.DictionaryArray.from_arrays(np.zeros(count, dtype=np.int8), [name]),
+        'music': pa.DictionaryArray.from_arrays(np.zeros(count, dtype=np.int8), [music]),
+        'time': events['time'],
+        'kind': pa.DictionaryArray.from_arrays(events['kind'], EVENT_KINDS),
+        'beat': events['beat'],
+        'direction': pa.DictionaryArray.from_arrays(events['direction'], directions),
+        'distance': events['distance'],
+        'reaction_time': events['reaction_time'],
+        'speed_multiplier': events['speed_multiplier'],
+    })
+    pq.write_table(table, path + '.parquet')
+
+
+def load_events(folder=EVENTS_DIR, filenames=None):
+    """Events of every run (or of the given files of the folder), as a dict of columns (kind and direction as names)."""
+    columns = {}
+    filenames = sorted(os.listdir(folder)) if filenames is None else filenames
+    parquet_files = [os.path.join(folder, f) for f in filenames if f.endswith('.parquet')]
+    if parquet_files:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        table = ds.dataset(parquet_files, format='parquet').to_table()
+        for column in table.column_names:
+            values = table.column(column)
+            if pa.types.is_dictionary(values.type):
+                values = values.cast(pa.string())
+            columns[column] = [values.to_numpy()]
+    for filename in filenames:
+        if not filename.endswith('.npz'):
+            continue
+        with np.load(os.path.join(folder, filename)) as data:
+            events = data['events']
+            run_columns = {
+                'session_id': np.full(len(events), str(data['session_id'])),
+                'name': np.full(len(events), str(data['name'])),
+                'music': np.full(len(events), str(data['music'])),
+                'kind': data['kinds'][events['kind']],
+                'direction': data['directions'][events['direction']],
+            }
+            for column in EVENT_DTYPE.names:
+                columns.setdefault(column, []).append(run_columns.get(column, events[column]))
+            for column in ('session_id', 'name', 'music'):
+                columns.setdefault(column, []).append(run_columns[column])
+    return {column: np.concatenate(arrays) for column, arrays in columns.items()}
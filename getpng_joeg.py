@@ -1,16 +1,22 @@
+import io
+
 import cairosvg
 
-def convert_svg_to_png(svg_file, output_file):
+def svg_to_png_bytes(svg_file, width=None, height=None):
+    """Rasterise un fichier SVG en PNG (en mémoire), à la taille donnée si besoin."""
+    return cairosvg.svg2png(url=svg_file, output_width=width, output_height=height)
+
+def convert_svg_to_png(svg_file, output_file, width=None, height=None):
     """Convertit un fichier SVG en PNG."""
-    cairosvg.svg2png(url=svg_file, write_to=output_file)
+    cairosvg.svg2png(url=svg_file, write_to=output_file, output_width=width, output_height=height)
 
-def convert_svg_to_jpeg(svg_file, output_file):
+def convert_svg_to_jpeg(svg_file, output_file, width=None, height=None):
     """Convertit un fichier SVG en JPEG."""
-    cairosvg.svg2png(url=svg_file, write_to="temp.png")
     from PIL import Image
-    with Image.open("temp.png") as img:
+    with Image.open(io.BytesIO(svg_to_png_bytes(svg_file, width, height))) as img:
         img.convert("RGB").save(output_file, "JPEG")
 
-# Exemple d'utilisation
-convert_svg_to_png("lJRBNZ.svg", "background.png")  # Convertit en PNG
-convert_svg_to_jpeg("lJRBNZ.svg", "background.jpeg")  # Convertit en JPEG
+# Exemple d'utilisation (les images du jeu sont construites par asset_bundle.py)
+if __name__ == '__main__':
+    convert_svg_to_png("lJRBNZ.svg", "background.png")  # Convertit en PNG
+    convert_svg_to_jpeg("lJRBNZ.svg", "background.jpeg")  # Convertit en JPEG
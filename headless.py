@@ -0,0 +1,114 @@
+import random
+
+import numpy as np
+
+import test12
+from test12 import DIRECTIONS, SIMULATION_STEP_MS, Game
+
+# --- Headless mode ---
+# Runs the real game loop without a window, a sound card or a human: the music
+# and the clocks are simulated, the directions come from a seeded RNG and the
+# inputs from a bot.
+
+
+class VirtualTime:
+    """Time in ms shared by the simulated music and clock, only moves when a frame ends."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def ticks(self):
+        return int(self.now)
+
+
+class SimulatedMusic:
+    """Stand-in for CachedMusic that loops a silent track of a given duration."""
+
+    def __init__(self, virtual_time, duration_ms):
+        self.virtual_time = virtual_time
+        self.duration_ms = duration_ms
+        self.start = None
+        self.paused_at = None
+
+    def prepare(self, music_file):
+        pass
+
+    def ready(self, music_file):
+        return True
+
+    def load(self, music_file):
+        self.start = None
+
+    def play(self):
+        self.start = self.virtual_time.now
+        self.paused_at = None
+
+    def stop(self):
+        self.start = None
+
+    def pause(self):
+        self.paused_at = self.virtual_time.now
+
+    def unpause(self):
+        if self.paused_at is not None:
+            self.start += self.virtual_time.now - self.paused_at
+            self.paused_at = None
+
+    def get_pos(self):
+        if self.start is None:
+            return -1
+        now = self.paused_at if self.paused_at is not None else self.virtual_time.now
+        return int(now - self.start)
+
+    def get_length(self):
+        return self.duration_ms
+
+    def get_busy(self):
+        return self.start is not None
+
+
+class VirtualClock:
+    """Stand-in for pygame.time.Clock, every tick moves the virtual time by one frame."""
+
+    def __init__(self, virtual_time, frame_ms=SIMULATION_STEP_MS):
+        self.virtual_time = virtual_time
+        self.frame_ms = frame_ms
+
+    def tick(self, framerate=0):
+        self.virtual_time.now += self.frame_ms
+        return self.frame_ms
+
+
+def defend_bot(reach=60):
+    """Bot pressing the direction of every enemy closer than reach (pixels)."""
+    def bot(game):
+        distances = game.enemies.distances(game.player)
+        directions = np.unique(game.enemies.direction[distances < reach])
+        return [DIRECTIONS[direction] for direction in directions]
+    return bot
+
+
+def make_headless_game(music_duration_ms, seed=0, frame_ms=SIMULATION_STEP_MS, bot=None):
+    """Create a Game running on simulated time. init_pygame(headless=True) is called if needed."""
+    if test12.screen is None:
+        test12.init_pygame(headless=True)
+    virtual_time = VirtualTime()
+    game = Game(music=SimulatedMusic(virtual_time, music_duration_ms),
+                clock=VirtualClock(virtual_time, frame_ms),
+                rng=random.Random(seed),
+                ticks=virtual_time.ticks)
+    game.save_results = False
+    game.bot = bot
+    game.name = 'headless'
+    game.music_file = 'headless'
+    return game
+
+
+def run_headless(game, beat_timestamps, max_frames, speed_multiplier=1.0):
+    """Play a run with the given beat map until game over or max_frames. Returns the frames played."""
+    game.start_run(beat_timestamps)
+    game.speed_multiplier = speed_multiplier
+    for frame in range(max_frames):
+        if game.run_frame():
+            return frame + 1
+    return max_frames
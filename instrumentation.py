@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+# Phases of a game frame, in the order they happen
+PHASES = ['events', 'update', 'collision', 'draw', 'flip', 'idle']
+INPUT_SOURCES = ['keyboard', 'serial', 'bot', 'replay']
+
+
+class GameStats:
+    """Frame timings and input latencies of a run, kept in fixed size ring buffers.
+
+    A frame is split in phases with mark(phase): the time since the previous
+    mark is added to that phase, so timing a phase costs one perf_counter call.
+    """
+
+    def __init__(self, frame_capacity=1 << 16, input_capacity=1 << 12):
+        # One row per frame: start time (s since the run started), then the duration (ms) of each phase
+        self.frames = np.zeros((frame_capacity, 1 + len(PHASES)), dtype=np.float32)
+        # One row per input: arrival time (s), source, latency until handled (ms), enemies hit
+        self.inputs = np.zeros((input_capacity, 4), dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        self.frame_count = 0
+        self.input_count = 0
+        self.run_start = time.perf_counter()
+        self.last_mark = self.run_start
+        self.current = np.zeros(len(PHASES))
+
+    def begin_frame(self):
+        self.last_mark = time.perf_counter()
+        self.frame_start = self.last_mark
+        self.current[:] = 0
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.current[PHASES.index(phase)] += (now - self.last_mark) * 1000
+        self.last_mark = now
+
+    def end_frame(self):
+        row = self.frames[self.frame_count % len(self.frames)]
+        row[0] = self.frame_start - self.run_start
+        row[1:] = self.current
+        self.frame_count += 1
+
+    def record_input(self, source, arrival_counter, hits):
+        # arrival_counter: time.perf_counter() when the input reached the game (or the serial thread)
+        now = time.perf_counter()
+        row = self.inputs[self.input_count % len(self.inputs)]
+        row[:] = (arrival_counter - self.run_start, INPUT_SOURCES.index(source), (now - arrival_counter) * 1000, hits)
+        self.input_count += 1
+
+    def ordered(self, buffer, count):
+        # Rows of a ring buffer from the oldest to the newest
+        if count <= len(buffer):
+            return buffer[:count]
+        start = count % len(buffer)
+        return np.concatenate([buffer[start:], buffer[:start]])
+
+    def frame_times(self, last=240):
+        # Total duration (ms) of the last frames
+        frames = self.ordered(self.frames, self.frame_count)[-last:]
+        return frames[:, 1:].sum(axis=1)
+
+    def summary(self, last=240):
+        """FPS, median and 99th percentile frame time (ms) over the last frames."""
+        frame_times = self.frame_times(last)
+        if not len(frame_times):
+            return 0.0, 0.0, 0.0
+        p50, p99 = np.percentile(frame_times, [50, 99])
+        return 1000 / max(frame_times.mean(), 1e-6), p50, p99
+
+    def snapshot(self):
+        # Copy of the trace, it can be saved by another thread while the buffers are reused
+        return {
+            'frames': self.ordered(self.frames, self.frame_count).copy(),
+            'frame_columns': np.array(['start'] + PHASES),
+            'inputs': self.ordered(self.inputs, self.input_count).copy(),
+            'input_columns': np.array(['arrival', 'source', 'latency', 'hits']),
+            'input_sources': np.array(INPUT_SOURCES),
+        }
+
+    def export(self, path):
+        # Compact trace of the run, open it with np.load(path)
+        save_trace(path, self.snapshot())
+
+
+def save_trace(path, trace):
+    # trace: GameStats.snapshot()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    np.savez_compressed(path, **trace)
+
+
+class StartupProfile:
+    """Time spent in each phase of the start of the game (test12.py --profile-startup)."""
+
+    def __init__(self, start):
+        self.start = start
+        self.last = start
+        self.phases = []
+
+    def mark(self, phase):
+        # The time since the previous mark is counted in this phase
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self.last) * 1000))
+        self.last = now
+
+    def report(self):
+        for phase, duration in self.phases:
+            print(f"  {phase:20} {duration:8.1f} ms")
+        print(f"  {'total':20} {(self.last - self.start) * 1000:8.1f} ms")
+        # The heavy libraries the start is meant to avoid
+        heavy = [module for module in ('librosa.beat', 'numba', 'scipy', 'sklearn', 'pyarrow') if module in sys.modules]
+        print("  heavy modules imported:", ", ".join(heavy) or "none")
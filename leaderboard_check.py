@@ -0,0 +1,152 @@
+"""End to end check of the leaderboard service: starts leaderboard_server.py and talks to it like a game.
+
+    python leaderboard_check.py               # on a free port, in a temporary folder
+    python leaderboard_check.py --port 18765
+
+The server runs as a subprocess with its own database, the client queues its
+runs in the same temporary folder, so results.db and the real queue are never
+touched. Checks, in order: the runs submitted reach the top (a queue line cut
+by a crash is skipped), a run submitted while the server is down stays queued
+on disk and is sent once it is back (a run sent twice is only saved once), an
+unchanged top answers "304 Not Modified", a bad n answers "400 Bad Request",
+and a run the server refuses is set aside without blocking the others. Exits
+with an error if a check fails.
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import leaderboard_client
+from leaderboard_client import LeaderboardClient
+from results_store import ResultsStore
+
+# Longest wait for the server to start or the client to catch up (s)
+TIMEOUT = 10.0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, database):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'leaderboard_server.py')
+    server = subprocess.Popen([sys.executable, script, '--port', str(port), '--database', database],
+                              stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError(f"the leaderboard server did not start on port {port}")
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def make_run(name, score, music='check.mp3'):
+    return {'name': name, 'score': score, 'end_time': '2024-05-01 15:30:00', 'music': music}
+
+
+def queued_runs(client):
+    with open(client.queue_file) as file:
+        return len(file.readlines())
+
+
+def run_checks(port, folder):
+    # The client asks again for the tops and reconnects quickly, the checks don't wait for minutes
+    leaderboard_client.TOP_REFRESH_INTERVAL = 0.2
+    leaderboard_client.RETRY_DELAY = 0.2
+    database = os.path.join(folder, 'leaderboard_check.db')
+    failures = []
+
+    def check(name, ok):
+        print(f"{'OK  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    server = start_server(port, database)
+    queue_file = os.path.join(folder, 'queue.jsonl')
+    with open(queue_file, 'w') as file:
+        # Last line cut by a crash, the next run is appended after it
+        file.write('{"session_id": "check-cut", "run": {"name": "cut", "sc')
+    client = LeaderboardClient(f"http://127.0.0.1:{port}", queue_file=queue_file)
+    client.start()
+    # Raw requests on a connection of their own, the one of the client belongs to its thread
+    probe = LeaderboardClient(f"http://127.0.0.1:{port}", queue_file=os.path.join(folder, 'probe.jsonl'))
+    try:
+        for index, score in enumerate([100, 300, 200]):
+            client.submit(f"check-{index}", make_run(f"player{index}", score))
+        expected = [('player1', 300), ('player2', 200), ('player0', 100)]
+        check("submitted runs reach the top",
+              wait_for(lambda: [row[:2] for row in client.top(3) or []] == expected))
+        check("top of one music", wait_for(lambda: len(client.top(5, 'check.mp3') or []) == 3))
+
+        server.terminate()
+        server.wait()
+        client.submit('check-3', make_run('player3', 500))
+        client.submit('check-0', make_run('player0', 100))  # Already saved by the server
+        check("runs queued on disk while the server is down",
+              wait_for(lambda: not client.online) and queued_runs(client) == 2)
+
+        server = start_server(port, database)
+        check("queued runs sent once the server is back", wait_for(lambda: queued_runs(client) == 0))
+        check("new run in the top", wait_for(lambda: (client.top(3) or [[None]])[0][0] == 'player3'))
+        store = ResultsStore(database)
+        check("a run sent twice is saved once", len(store.runs_since(0)) == 4)
+        store.close()
+
+        status, etag, _ = probe.request('GET', '/top?n=3')
+        status, _, payload = probe.request('GET', '/top?n=3', headers={'If-None-Match': etag})
+        check("unchanged top answers 304", status == 304 and payload is None)
+        for n in ('abc', '-1', '0'):
+            try:
+                probe.request('GET', f'/top?n={n}')
+                check(f"n={n} answers 400", False)
+            except http.client.HTTPException as error:
+                check(f"n={n} answers 400", ': 400 ' in str(error))
+
+        client.submit('check-bad', {'name': 'bad', 'score': 'high'})
+        client.submit('check-5', make_run('player5', 50))
+        check("refused run set aside", wait_for(lambda: queued_runs(client) == 0)
+              and os.path.isfile(client.rejected_file))
+        store = ResultsStore(database)
+        check("the other runs are still sent", len(store.runs_since(0)) == 5)
+        store.close()
+    finally:
+        client.stop()
+        probe.close()
+        server.terminate()
+        server.wait()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, help='port of the test server (default: a free one)')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as folder:
+        failures = run_checks(args.port or free_port(), folder)
+    if failures:
+        print(f"{len(failures)} checks failed")
+        sys.exit(1)
+    print("Every check passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import http.client
+import json
+import os
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+# --- Configuration ---
+
+# Runs not acknowledged by the leaderboard server yet, one JSON line per run
+QUEUE_FILE = '.leaderboard_queue.jsonl'
+# Most runs sent in one request
+MAX_BATCH = 50
+# Age after which a top-N table is asked again to the server (s)
+TOP_REFRESH_INTERVAL = 5.0
+# Wait before trying again when the server is unreachable (s)
+RETRY_DELAY = 5.0
+REQUEST_TIMEOUT = 2.0
+
+
+class RejectedRequest(http.client.HTTPException):
+    """The server answered 4xx: the same request would be refused again."""
+
+
+class LeaderboardClient(threading.Thread):
+    """Talks to leaderboard_server.py in a background thread, the game never waits for the network.
+
+    submit() saves the run to QUEUE_FILE and returns: the thread sends the
+    queued runs in batches over one kept-alive connection, and removes them
+    from the file once the server acknowledged them (the server ignores a run
+    it already has). While the server is unreachable the runs stay queued, on
+    disk, and are sent when it is back, even after a restart of the game.
+    The runs the server refuses are moved to <queue file>.rejected.jsonl.
+    top() answers from the tables fetched last, and asks the server again in
+    the background when they are older than TOP_REFRESH_INTERVAL, with their
+    ETag so an unchanged table costs an empty answer.
+    """
+
+    def __init__(self, url, queue_file=QUEUE_FILE):
+        super().__init__(daemon=True)
+        address = urlsplit(url)
+        self.host = address.hostname
+        self.port = address.port or 80
+        self.queue_file = queue_file
+        self.rejected_file = os.path.splitext(queue_file)[0] + '.rejected.jsonl'
+        self.connection = None
+        self.online = False
+        self.lock = threading.Lock()
+        self.pending = self.read_queue()  # [{'session_id': ..., 'run': {...}}]
+        self.tops = {}  # (n, music) -> (rows, etag, time fetched)
+        self.wanted = set()  # (n, music) asked by the game
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+
+    def read_queue(self):
+        if not os.path.isfile(self.queue_file):
+            return []
+        items = []
+        with open(self.queue_file) as file:
+            for line in file:
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    # A line cut by a crash is dropped, the run is still in results.db
+                    pass
+        return items
+
+    def submit(self, session_id, run):
+        # Called by the session journal thread once the run is saved locally
+        item = {'session_id': session_id, 'run': run}
+        with self.lock:
+            with open(self.queue_file, 'ab+') as file:
+                # After a line cut by a crash, the run goes on a new line so it can still be read
+                if file.seek(0, os.SEEK_END) > 0:
+                    file.seek(-1, os.SEEK_END)
+                    if file.read(1) != b'\n':
+                        file.write(b'\n')
+                file.write((json.dumps(item) + "\n").encode())
+                file.flush()
+                os.fsync(file.fileno())
+            self.pending.append(item)
+        self.wake.set()
+
+    def top(self, n=5, music=None):
+        """Last top-n rows known for a music (overall if None), or None before the first answer of the server."""
+        key = (n, music)
+        cached = self.tops.get(key)
+        if key not in self.wanted or cached is None or time.monotonic() - cached[2] > TOP_REFRESH_INTERVAL:
+            self.wanted.add(key)
+            self.wake.set()
+        return None if cached is None else cached[0]
+
+    def run(self):
+        while not self.stopped.is_set():
+            errors = []
+            # The tops are still refreshed while the runs can't be sent
+            for step in (self.send_pending, self.refresh_tops):
+                try:
+                    step()
+                except (OSError, http.client.HTTPException, ValueError) as error:
+                    errors.append(error)
+                    self.close()
+            if errors:
+                if self.online:
+                    print("Leaderboard server unreachable:", errors[0])
+                self.online = False
+                self.stopped.wait(RETRY_DELAY)
+            else:
+                self.online = True
+                # Sleep until a new run or a table gets old
+                self.wake.wait(TOP_REFRESH_INTERVAL)
+            self.wake.clear()
+
+    def request(self, method, path, body=None, headers=None):
+        # Same connection for every request while the server keeps it open
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT)
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            # The server closed the idle connection, open a new one once
+            self.close()
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT)
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+        data = response.read()
+        if 400 <= response.status < 500:
+            raise RejectedRequest(f"{method} {path}: {response.status} {data[:200]!r}")
+        if response.status not in (200, 304):
+            raise http.client.HTTPException(f"{method} {path}: {response.status} {data[:200]!r}")
+        return response.status, response.getheader('ETag'), json.loads(data) if data else None
+
+    def send_pending(self):
+        while self.pending:
+            batch = self.pending[:MAX_BATCH]
+            try:
+                self.request('POST', '/runs', {'runs': batch})
+            except RejectedRequest:
+                # One by one, to keep sending the runs of the batch the server accepts
+                for item in batch:
+                    try:
+                        self.request('POST', '/runs', {'runs': [item]})
+                    except RejectedRequest as error:
+                        self.set_aside(item, error)
+            with self.lock:
+                # Runs submitted meanwhile were appended after the batch
+                self.pending = self.pending[len(batch):]
+                temp_file = self.queue_file + '.tmp'
+                with open(temp_file, 'w') as file:
+                    file.writelines(json.dumps(item) + "\n" for item in self.pending)
+                os.replace(temp_file, self.queue_file)
+
+    def set_aside(self, item, error):
+        print("Run of session", item.get('session_id'), "refused by the leaderboard server:", error)
+        with open(self.rejected_file, 'a') as file:
+            file.write(json.dumps(item) + "\n")
+
+    def refresh_tops(self):
+        now = time.monotonic()
+        for n, music in list(self.wanted):
+            cached = self.tops.get((n, music))
+            if cached is not None and now - cached[2] < TOP_REFRESH_INTERVAL:
+                continue
+            query = {'n': n} if music is None else {'n': n, 'music': music}
+            headers = {'If-None-Match': cached[1]} if cached is not None and cached[1] else {}
+            status, etag, payload = self.request('GET', '/top?' + urlencode(query), headers=headers)
+            if status == 304:
+                self.tops[(n, music)] = (cached[0], cached[1], now)
+            else:
+                self.tops[(n, music)] = ([tuple(row) for row in payload['top']], etag, now)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
@@ -0,0 +1,161 @@
+"""Leaderboard service shared by several booths: each game sends its runs, and reads the best scores of all of them.
+
+    python leaderboard_server.py                          # listen on port 8765, runs saved in leaderboard_server.db
+    python leaderboard_server.py --host 0.0.0.0 --port 8765 --database booths.db
+
+Start the games with `python test12.py --leaderboard http://<server>:8765`.
+A small HTTP/1.1 server (asyncio, keep-alive connections):
+
+    POST /runs     {"runs": [{"session_id": ..., "run": {...}}, ...]}   -> {"accepted": n, "duplicates": n}
+    GET  /top?n=5[&music=<music>]                                       -> {"top": [[name, score, date, music], ...]}
+
+A run is only saved once per session id, so a game can send a batch again
+after a lost answer. The best TOP_K runs overall and of each music are kept in
+memory; GET /top answers with an ETag and "304 Not Modified" when the client
+already has that table.
+"""
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+from results_store import ResultsStore
+
+DEFAULT_PORT = 8765
+DATABASE_FILE = 'leaderboard_server.db'
+# Runs kept in memory per music (and overall), the most a client can ask for
+TOP_K = 100
+# Largest request body accepted (a batch of runs)
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class TopIndex:
+    """The best runs overall (key None) and per music, in memory, each table with a version for the ETags."""
+
+    def __init__(self, k=TOP_K):
+        self.k = k
+        self.tables = {}  # key -> sorted [(-score, order, row)]
+        self.versions = {}
+        self.order = itertools.count()  # Same score: the oldest run first, like ResultsStore.top
+
+    def add(self, run):
+        row = (run['name'], run['score'], run.get('end_time'), run.get('music'))
+        # A run without a music is only in the overall table, once
+        for key in {None, run.get('music')}:
+            table = self.tables.setdefault(key, [])
+            entry = (-run['score'], next(self.order), row)
+            if len(table) >= self.k and entry >= table[-1]:
+                continue
+            bisect.insort(table, entry)
+            del table[self.k:]
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+    def top(self, n, music=None):
+        return [list(row) for _, _, row in self.tables.get(music, [])[:n]]
+
+    def version(self, music=None):
+        return self.versions.get(music, 0)
+
+
+class LeaderboardServer:
+    def __init__(self, store):
+        self.store = store
+        self.index = TopIndex()
+        # Part of the ETags, the versions start over when the server restarts
+        self.boot_id = uuid.uuid4().hex[:8]
+        # Every run of the database, oldest first so the ties keep their order
+        for _, run in store.runs_since(0):
+            self.index.add(run)
+
+    async def handle_connection(self, reader, writer):
+        # One client (a game) keeps its connection open for all its requests
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {'error': 'request too large'})
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, payload, extra_headers = await self.handle(method, target, headers, body)
+                await self.respond(writer, status, payload, extra_headers)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, method, target, headers, body):
+        url = urlsplit(target)
+        if method == 'POST' and url.path == '/runs':
+            try:
+                sessions = [(str(item['session_id']), item['run']) for item in json.loads(body)['runs']]
+                valid = all(isinstance(run['name'], str) and isinstance(run['score'], int) for _, run in sessions)
+            except (ValueError, KeyError, TypeError):
+                valid = False
+            if not valid:
+                return 400, {'error': 'expected {"runs": [{"session_id": ..., "run": {"name": ..., "score": ...}}]}'}, {}
+            # SQLite in a thread, the other games keep being answered meanwhile
+            inserted = await asyncio.to_thread(self.store.insert_runs, sessions)
+            for _, run in inserted:
+                self.index.add(run)
+            return 200, {'accepted': len(inserted), 'duplicates': len(sessions) - len(inserted)}, {}
+        if method == 'GET' and url.path == '/top':
+            query = parse_qs(url.query)
+            n = query.get('n', ['5'])[0]
+            if not n.isdigit() or int(n) < 1:
+                return 400, {'error': 'n must be a positive integer'}, {}
+            n = min(int(n), TOP_K)
+            music = query.get('music', [None])[0]
+            etag = f'"{self.boot_id}-{self.index.version(music)}-{n}"'
+            if headers.get('if-none-match') == etag:
+                return 304, None, {'ETag': etag}
+            return 200, {'top': self.index.top(n, music)}, {'ETag': etag}
+        return 404, {'error': 'not found'}, {}
+
+    async def respond(self, writer, status, payload, extra_headers=None):
+        reasons = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large'}
+        body = b'' if payload is None else json.dumps(payload).encode()
+        lines = [f"HTTP/1.1 {status} {reasons[status]}", f"Content-Length: {len(body)}"]
+        if payload is not None:
+            lines.append("Content-Type: application/json")
+        lines += [f"{name}: {value}" for name, value in (extra_headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print("Leaderboard server listening on", ", ".join(str(socket.getsockname()) for socket in server.sockets))
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (0.0.0.0 for the other booths)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--database', default=DATABASE_FILE, help='SQLite file of the runs received')
+    args = parser.parse_args()
+    server = LeaderboardServer(ResultsStore(args.database))
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
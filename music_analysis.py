@@ -0,0 +1,198 @@
+import csv
+import multiprocessing
+import os
+
+import numpy as np
+
+import audio_cache
+import beat_cache
+
+# --- Music analysis ---
+
+def extract_music_features(music_file):
+    """Decode a track once and return its beat map (beat_cache.BEAT_DTYPE rows) and its music info.
+
+    The samples decoded for the game (audio cache) are mixed down to mono
+    float32 at the analysis sample rate, every feature comes from the same
+    onset envelope and RMS frames.
+    """
+    import librosa  # Slow to import (numba, scipy...), only the analysis needs it
+    hop_length = beat_cache.ANALYSIS_PARAMS['hop_length']
+    sr = beat_cache.ANALYSIS_PARAMS['sr']
+    samples = audio_cache.decode(music_file)
+    y = librosa.resample(samples.mean(axis=1, dtype=np.float32) / 32768,
+                         orig_sr=audio_cache.FREQUENCY, target_sr=sr)
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length)
+    tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr, hop_length=hop_length)
+    rms = librosa.feature.rms(y=y, hop_length=hop_length)[0]
+    beat_frames = beat_frames[beat_frames < len(rms)]
+
+    beats = np.zeros(len(beat_frames), dtype=beat_cache.BEAT_DTYPE)
+    beats['time'] = librosa.frames_to_time(beat_frames, sr=sr, hop_length=hop_length) * 1000
+    beats['strength'] = onset_env[beat_frames] / max(float(onset_env.max()), 1e-9)
+    if len(beat_frames):
+        # Mean energy of the frames between a beat and the next one
+        lengths = np.diff(np.append(beat_frames, len(rms)))
+        beats['energy'] = np.add.reduceat(rms, beat_frames) / np.maximum(lengths, 1)
+        # Bars of 4 beats, starting at the beat phase with the strongest onsets
+        phase = int(np.argmax([beats['strength'][start::4].mean() for start in range(min(4, len(beats)))]))
+        beats['downbeat'] = np.arange(len(beats)) % 4 == phase
+
+    features = {
+        'Music': os.path.basename(music_file),
+        'Total Beats': len(beat_frames),
+        'BPM': float(np.atleast_1d(tempo)[0]),
+        'Loudness': float(rms.mean()),
+        'M_Duration': len(y) / sr,
+    }
+    return beats, features
+
+
+def stream_beats(music_file, block_length=256, frame_length=2048):
+    """Yield the beat timestamps (ms) of a track block by block while it is being decoded.
+
+    Less accurate than extract_music_features (each block is tracked on its own), but the
+    first beats are known after decoding a few seconds of audio instead of the whole file.
+    """
+    import librosa  # The game only imports it when a music is streamed
+    hop_length = beat_cache.ANALYSIS_PARAMS['hop_length']
+    sr = librosa.get_samplerate(music_file)
+    stream = librosa.stream(music_file, block_length=block_length, frame_length=frame_length,
+                            hop_length=hop_length, fill_value=0)
+    tempo = 120.0
+    last_beat = None
+    for block_index, y_block in enumerate(stream):
+        block_start = block_index * block_length * hop_length / sr
+        onset_env = librosa.onset.onset_strength(y=y_block, sr=sr, hop_length=hop_length, center=False)
+        block_tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr,
+                                                           hop_length=hop_length, start_bpm=tempo)
+        tempo = float(np.atleast_1d(block_tempo)[0]) or tempo
+        beat_times = block_start + librosa.frames_to_time(beat_frames, sr=sr, hop_length=hop_length)
+        # Drop the beats found twice around the border of two blocks
+        new_beats = []
+        for time in beat_times:
+            if last_beat is None or time - last_beat >= 30.0 / tempo:
+                new_beats.append(int(time * 1000))
+                last_beat = time
+        yield new_beats
+
+
+def warm_up():
+    # The first beat_track call of a process compiles its numba code, which takes seconds
+    import librosa
+    onset_env = np.random.default_rng(0).random(512).astype(np.float32)
+    librosa.beat.beat_track(onset_envelope=onset_env, sr=22050)
+
+
+def cached_features(music_file):
+    """Music info of a track whose beat map and music info are both cached, or None."""
+    features = beat_cache.load_features(music_file)
+    if features is not None and beat_cache.load_beat_features(music_file) is not None:
+        return features
+    return None
+
+
+def analyze_track(music_file):
+    """Make sure the beat map and music info of a track are in the cache, and return the music info.
+
+    Runs in the worker processes of MusicAnalyzer, so it only talks to the game through the cache.
+    """
+    features = cached_features(music_file)
+    if features is not None:
+        return features
+    beats, features = extract_music_features(music_file)
+    beat_cache.store_beats(music_file, beats)
+    beat_cache.store_features(music_file, features)
+    return features
+
+
+class CachedResult:
+    """Music info of a track found in the cache, answers like the AsyncResult of a track being analysed."""
+
+    def __init__(self, features):
+        self.features = features
+
+    def ready(self):
+        return True
+
+    def successful(self):
+        return True
+
+    def get(self):
+        return self.features
+
+
+class MusicAnalyzer:
+    """Analyses the whole music library in a pool of worker processes.
+
+    librosa is CPU bound, so separate processes keep the pygame loop responsive
+    (threads would fight it for the GIL).
+    """
+
+    def __init__(self, music_folder='musics', music_info_file='music_info.csv'):
+        self.music_folder = music_folder
+        self.music_info_file = music_info_file
+        self.pool = None
+        self.results = {}
+        self.music_info_written = False
+
+    def start(self, music_list):
+        # Only the tracks missing from the cache need the workers (the pool stays None if there is none)
+        to_analyse = []
+        for music in music_list:
+            music_file = os.path.join(self.music_folder, music)
+            features = cached_features(music_file)
+            if features is None:
+                to_analyse.append(music_file)
+            else:
+                self.results[music_file] = CachedResult(features)
+        if not to_analyse:
+            return
+        # Spawn (rather than fork) so the workers never inherit the pygame window or the serial port
+        context = multiprocessing.get_context('spawn')
+        processes = max(1, min(len(to_analyse), (os.cpu_count() or 2) - 1))
+        self.pool = context.Pool(processes)
+        for music_file in to_analyse:
+            self.results[music_file] = self.pool.apply_async(analyze_track, (music_file,))
+        self.pool.close()
+
+    def status(self, music_file):
+        result = self.results.get(music_file)
+        if result is None:
+            return 'unknown'
+        if not result.ready():
+            return 'analysing'
+        return 'ready' if result.successful() else 'failed'
+
+    def wait(self, music_file):
+        # Block until the track has been analysed; errors are raised again here
+        result = self.results.get(music_file)
+        if result is not None:
+            return result.get()
+        return analyze_track(music_file)
+
+    def all_ready(self):
+        return bool(self.results) and all(result.ready() for result in self.results.values())
+
+    def write_music_info(self):
+        # Export music_info.csv (used by Analysis.ipynb) once every track is analysed,
+        # only if the workers found something new (the file is tracked by git)
+        if self.music_info_written or not self.all_ready():
+            return False
+        self.music_info_written = True
+        analysed = any(not isinstance(result, CachedResult) and result.successful() for result in self.results.values())
+        if not analysed and os.path.isfile(self.music_info_file):
+            return False
+        # Sorted by music, so the file doesn't change with the order of os.listdir
+        rows = sorted((result.get() for result in self.results.values() if result.successful()),
+                      key=lambda row: row['Music'])
+        with open(self.music_info_file, mode='w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=['Music', 'Total Beats', 'BPM', 'Loudness', 'M_Duration'])
+            writer.writeheader()
+            writer.writerows(rows)
+        return True
+
+    def terminate(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
@@ -0,0 +1,81 @@
+import math
+
+import pygame
+
+
+def present(surface, rects, viewport=None):
+    """Update the display with some regions of a surface drawn in the window.
+
+    viewport: rect of the window showing the surface scaled down, when it is
+    drawn off screen (station mode on a display too small for every station at 1x).
+    """
+    if viewport is None:
+        x, y = surface.get_abs_offset()
+        pygame.display.update([rect.move(x, y) for rect in rects])
+        return
+    window = pygame.display.get_surface()
+    scale_x = viewport.width / surface.get_width()
+    scale_y = viewport.height / surface.get_height()
+    updated = []
+    for rect in rects:
+        rect = rect.clip(surface.get_rect())
+        if not rect.width or not rect.height:
+            continue
+        # Whole pixels of the viewport covered by the region
+        left, top = math.floor(rect.left * scale_x), math.floor(rect.top * scale_y)
+        dest = pygame.Rect(viewport.left + left, viewport.top + top,
+                           max(math.ceil(rect.right * scale_x) - left, 1), max(math.ceil(rect.bottom * scale_y) - top, 1))
+        pygame.transform.smoothscale(surface.subsurface(rect), dest.size, window.subsurface(dest))
+        updated.append(dest)
+    pygame.display.update(updated)
+
+
+class DirtyRenderer:
+    """Draws the game over a static background and only pushes the changed regions to the display.
+
+    Every frame, the regions drawn at the previous frame are restored from the
+    background, the new sprites are drawn, and only the union of both is updated
+    with pygame.display.update(rects) instead of a full flip.
+    """
+
+    def __init__(self, screen, background, viewport=None):
+        self.screen = screen
+        self.background = background
+        self.viewport = viewport  # See present()
+        self.previous_rects = []
+        self.drawn_rects = []
+        self.full_redraw = True
+
+    def invalidate(self):
+        # Next frame redraws the whole screen (after a pause screen for example)
+        self.full_redraw = True
+
+    def begin(self):
+        if self.full_redraw:
+            self.screen.blit(self.background, (0, 0))
+        else:
+            for rect in self.previous_rects:
+                self.screen.blit(self.background, rect, rect)
+        self.drawn_rects = []
+
+    def blit(self, surface, dest):
+        rect = self.screen.blit(surface, dest)
+        self.drawn_rects.append(rect)
+        return rect
+
+    def blits(self, blit_sequence, doreturn=True):
+        rects = self.screen.blits(blit_sequence)
+        self.drawn_rects.extend(rects)
+        return rects if doreturn else None
+
+    def end(self):
+        # The screen can be a viewport of the window (a subsurface, or scaled down), see present()
+        if self.full_redraw:
+            if self.screen.get_parent() is None and self.viewport is None:
+                pygame.display.flip()
+            else:
+                present(self.screen, [self.screen.get_rect()], self.viewport)
+            self.full_redraw = False
+        else:
+            present(self.screen, self.previous_rects + self.drawn_rects, self.viewport)
+        self.previous_rects = self.drawn_rects
@@ -0,0 +1,135 @@
+"""Replays of the saved runs, headless to rescore them or in real time to show them.
+
+    python replay.py                                   # rescore every replay of the players folder
+    python replay.py rescore players/bob_*.replay.npz  # rescore some of them
+    python replay.py play players/bob_20240501-153000.replay.npz   # watch a run again, with its music
+
+At the end of each run the game saves `<name>_<start time>.replay.npz` next to
+the player's CSV file: the seed of the zombie directions, the music (name and
+hash of the file), its beat map and every input with the simulation step it
+was handled at, and the step and beat of every zombie spawned (a streamed beat
+map changes during the run). The game logic is deterministic given those, so a
+replay plays the run again exactly. Rescoring runs the simulation without drawing and
+without waiting for the music, to check a change of the rules against every
+run played so far.
+"""
+import glob
+import math
+import os
+import sys
+import time
+from collections import deque
+
+import numpy as np
+import pygame
+
+import beat_cache
+import headless
+import test12
+from test12 import DIRECTIONS, REPLAY_VERSION, Game, render_text
+
+
+def load_replay(path):
+    with np.load(path) as data:
+        replay = {key: data[key][()] for key in data.files}
+    # Format 1 saved the beat map of the end of the run instead of the spawns, still right for the runs not streamed
+    if replay['version'] not in (1, REPLAY_VERSION):
+        raise ValueError(f"{path}: replay format {replay['version']}, expected {REPLAY_VERSION}")
+    return replay
+
+
+def scripted_inputs(replay):
+    # (step, game time, direction) of each input, in the order they were handled
+    return deque(zip(replay['input_steps'].tolist(), replay['input_times'].tolist(),
+                     [DIRECTIONS[direction] for direction in replay['input_directions']]))
+
+
+def scripted_spawns(replay):
+    # (step, beat) of each zombie, in the order they spawned
+    return deque(zip(replay['spawn_steps'].tolist(), replay['spawn_beats'].tolist()))
+
+
+def start_replay(game, replay, start_music=True):
+    game.name = str(replay['name'])
+    game.music_file = os.path.join('musics', str(replay['music']))
+    beats = replay['beats'].tolist() if replay['version'] == 1 else []
+    game.start_run(beats, start_music=start_music, seed=int(replay['seed']))
+    game.scripted_spawns = scripted_spawns(replay) if replay['version'] != 1 else None
+    # The loops start when they did in the recorded run, even if the music file was re-encoded since
+    game.music_length = float(replay['music_length'])
+    game.scripted_inputs = scripted_inputs(replay)
+
+
+def rescore(game, replay):
+    """Play a replay headless as fast as possible with a game of make_rescore_game(). Returns the score."""
+    start_replay(game, replay, start_music=False)
+    game.advance(float(replay['end_time']), max_steps=math.inf)
+    return game.score
+
+
+def make_rescore_game():
+    # One game rescores all the replays, nothing is drawn
+    return headless.make_headless_game(0)
+
+
+def rescore_all(paths):
+    game = make_rescore_game()
+    changed = 0
+    start = time.perf_counter()
+    for path in paths:
+        replay = load_replay(path)
+        score = rescore(game, replay)
+        if score != replay['score']:
+            changed += 1
+        print(f"{os.path.basename(path):45} {str(replay['music']):25} {int(replay['score']):8} -> {score:8}")
+    print(f"{len(paths)} runs rescored in {time.perf_counter() - start:.2f} s, {changed} scores changed")
+
+
+def play(path):
+    """Show a replay in real time, with its music. Escape stops it. Returns the score at the end."""
+    replay = load_replay(path)
+    music_file = os.path.join('musics', str(replay['music']))
+    # The game time follows the music, a replay can't be shown without it
+    if not os.path.isfile(music_file):
+        print(f"{music_file} not found")
+        return
+    if beat_cache.file_hash(music_file) != replay['track']:
+        print(f"Warning: {music_file} changed since the run, the zombies follow the recorded beats")
+    test12.init_pygame()
+    game = Game()
+    game.save_results = False
+    game.key_directions = {}  # Only the recorded inputs play
+    start_replay(game, replay)
+    end_time = float(replay['end_time'])
+    while game.simulated_time < end_time:
+        events = []
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                game.music.stop()
+                pygame.quit()
+                return
+            events.append(event)
+        if game.run_frame(events):
+            break
+    game.music.stop()
+    game.surface.fill((0, 0, 0))
+    game.surface.blit(render_text(f"Replay of {game.name}: {game.score}"), (test12.WIDTH // 2 - 160, test12.HEIGHT // 2))
+    pygame.display.flip()
+    pygame.time.wait(3000)
+    pygame.quit()
+    return game.score
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'rescore'
+    paths = sys.argv[2:]
+    if command == 'rescore':
+        rescore_all(paths or sorted(glob.glob(os.path.join('players', '*.replay.npz'))))
+    elif command == 'play' and len(paths) == 1:
+        play(paths[0])
+    else:
+        print(__doc__)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""Results of every run, stored in an SQLite database (WAL mode).
+
+    python results_store.py import     # import players/*.csv and leaderboard.csv (done automatically once)
+    python results_store.py top [n] [music]
+    python results_store.py history <name>
+"""
+import csv
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+DATABASE_FILE = 'results.db'
+# Least time between two checks for runs saved by the other booths (s), about one menu refresh
+CHANGE_CHECK_INTERVAL = 0.25
+
+# Header of the players/<name>.csv files
+PLAYER_CSV_HEADER = ['Name', 'Score', 'Total Blocks', 'Just in Time', 'Normal', 'Too Early',
+                     'Up', 'Down', 'Left', 'Right', 'Start Time', 'End Time', 'Duration', 'Music', 'Average Reaction Time']
+# Columns of a run, in the order of the players/<name>.csv files
+RUN_COLUMNS = ['name', 'score', 'total_blocks', 'just_in_time', 'normal', 'too_early',
+               'up', 'down', 'left', 'right', 'start_time', 'end_time', 'duration', 'music',
+               'average_reaction_time']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    total_blocks INTEGER, just_in_time INTEGER, normal INTEGER, too_early INTEGER,
+    up INTEGER, down INTEGER, left INTEGER, right INTEGER,
+    start_time TEXT,
+    end_time TEXT,
+    duration REAL,
+    music TEXT,
+    average_reaction_time REAL,
+    session_id TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_by_score ON runs (score DESC);
+CREATE INDEX IF NOT EXISTS runs_by_music_score ON runs (music, score DESC);
+CREATE INDEX IF NOT EXISTS runs_by_name ON runs (name, end_time);
+CREATE UNIQUE INDEX IF NOT EXISTS runs_by_session ON runs (session_id);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class ResultsStore:
+    """Small repository over the runs table.
+
+    The top-N queries are answered by the score indexes and cached until the
+    next insert, here or by another booth sharing the database (seen through
+    PRAGMA data_version), so the leaderboard screen can ask for them on every frame.
+    The store is shared by the game and the session writer thread.
+    """
+
+    def __init__(self, path=DATABASE_FILE):
+        # Several booths can share the database, wait for each other's writes
+        self.connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(runs)")]
+        if columns and 'session_id' not in columns:
+            # Database created before the session journal
+            self.connection.execute("ALTER TABLE runs ADD COLUMN session_id TEXT")
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        self.top_cache = {}
+        self.data_version = None
+        self.last_change_check = 0.0
+
+    def close(self):
+        self.connection.close()
+
+    def insert_run(self, run, session_id=None):
+        """Insert a run, a dict with the RUN_COLUMNS keys (missing ones are stored as NULL).
+
+        Returns the id of the new row, or None if the session was already saved.
+        """
+        columns = RUN_COLUMNS + ['session_id']
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                f"INSERT OR IGNORE INTO runs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [run.get(column) for column in RUN_COLUMNS] + [session_id])
+            self.top_cache = {}
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def insert_runs(self, sessions):
+        """Insert (session_id, run) pairs in one transaction. Returns the pairs that were not saved yet."""
+        columns = RUN_COLUMNS + ['session_id']
+        inserted = []
+        with self.lock, self.connection:
+            for session_id, run in sessions:
+                cursor = self.connection.execute(
+                    f"INSERT OR IGNORE INTO runs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    [run.get(column) for column in RUN_COLUMNS] + [session_id])
+                if cursor.rowcount:
+                    inserted.append((session_id, run))
+            self.top_cache = {}
+        return inserted
+
+    def top(self, n=5, music=None):
+        """Best n runs as (name, score, date, music) rows, overall or on one music."""
+        key = (n, music)
+        now = time.monotonic()
+        if now - self.last_change_check >= CHANGE_CHECK_INTERVAL:
+            # data_version changes when another connection commits, a cheap read of the WAL header
+            self.last_change_check = now
+            with self.lock:
+                data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self.data_version:
+                self.data_version = data_version
+                self.top_cache = {}
+        top_cache = self.top_cache
+        if key not in top_cache:
+            with self.lock:
+                if music is None:
+                    rows = self.connection.execute(
+                        "SELECT name, score, end_time, music FROM runs ORDER BY score DESC, id LIMIT ?", (n,))
+                else:
+                    rows = self.connection.execute(
+                        "SELECT name, score, end_time, music FROM runs WHERE music = ? ORDER BY score DESC, id LIMIT ?",
+                        (music, n))
+                top_cache[key] = rows.fetchall()
+        return top_cache[key]
+
+    def player_history(self, name):
+        """Every run of a player, oldest first, as dicts with the RUN_COLUMNS keys."""
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT {', '.join(RUN_COLUMNS)} FROM runs WHERE name = ? ORDER BY end_time, id", (name,)).fetchall()
+        return [dict(zip(RUN_COLUMNS, row)) for row in rows]
+
+    def runs_since(self, run_id):
+        """(id, run) of the runs saved after the run run_id, oldest first."""
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT id, {', '.join(RUN_COLUMNS)} FROM runs WHERE id > ? ORDER BY id", (run_id,)).fetchall()
+        return [(row[0], dict(zip(RUN_COLUMNS, row[1:]))) for row in rows]
+
+    def import_csv_once(self, players_folder='players', leaderboard_file='leaderboard.csv'):
+        # The CSV files written by the previous versions of the game are imported on the first start only
+        if self.connection.execute("SELECT 1 FROM meta WHERE key = 'csv_imported'").fetchone():
+            return 0
+        count = self.import_csv(players_folder, leaderboard_file)
+        with self.connection:
+            self.connection.execute("INSERT INTO meta VALUES ('csv_imported', ?)", (str(count),))
+        return count
+
+    def import_csv(self, players_folder='players', leaderboard_file='leaderboard.csv'):
+        """Import players/*.csv and the leaderboard rows that have no matching player run."""
+        runs = []
+        known = set()
+        if os.path.isdir(players_folder):
+            for filename in sorted(os.listdir(players_folder)):
+                if not filename.endswith('.csv'):
+                    continue
+                with open(os.path.join(players_folder, filename), newline='') as file:
+                    reader = csv.reader(file)
+                    next(reader, None)  # Skip header
+                    for row in reader:
+                        if len(row) < len(RUN_COLUMNS):
+                            continue
+                        run = dict(zip(RUN_COLUMNS, row))
+                        runs.append(run)
+                        known.add((run['name'], int(run['score']), run['end_time'], run['music']))
+        if os.path.isfile(leaderboard_file):
+            with open(leaderboard_file, newline='') as file:
+                reader = csv.reader(file)
+                # Skip header, the old files use 'Nom' instead of 'Name' so only the positions are used
+                next(reader, None)
+                for row in reader:
+                    if len(row) < 4:
+                        continue
+                    name, score, date, music = row[:4]
+                    # The game wrote every run to both files, keep a single copy
+                    if (name, int(score), date, music) not in known:
+                        runs.append({'name': name, 'score': score, 'end_time': date, 'music': music})
+        with self.lock, self.connection:
+            self.connection.executemany(
+                f"INSERT INTO runs ({', '.join(RUN_COLUMNS)}) VALUES ({', '.join('?' * len(RUN_COLUMNS))})",
+                [[run.get(column) for column in RUN_COLUMNS] for run in runs])
+            self.top_cache = {}
+        return len(runs)
+
+
+@contextmanager
+def file_lock(path, timeout=10.0, stale_after=30.0):
+    """Lock shared by every game instance writing to path (a path + '.lock' file, works on Windows too)."""
+    lock_path = path + '.lock'
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            descriptor = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                # Lock left behind by an instance that crashed
+                if time.time() - os.path.getmtime(lock_path) > stale_after:
+                    os.remove(lock_path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{lock_path} is held by another instance")
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        os.close(descriptor)
+        os.remove(lock_path)
+
+
+def append_player_csv(run, players_folder='players'):
+    # players/<name>.csv, still written for Analysis.ipynb
+    os.makedirs(players_folder, exist_ok=True)
+    player_file = os.path.join(players_folder, f"{run['name']}.csv")
+    with file_lock(player_file):
+        # Write header if the file is new or empty
+        write_header = not os.path.isfile(player_file) or os.path.getsize(player_file) == 0
+        with open(player_file, mode='a', newline='') as file:
+            writer = csv.writer(file)
+            if write_header:
+                writer.writerow(PLAYER_CSV_HEADER)
+            writer.writerow([run[column] for column in RUN_COLUMNS])
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def main():
+    store = ResultsStore()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'top'
+    if command == 'import':
+        print(store.import_csv_once(), "runs imported")
+    elif command == 'top':
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+        music = sys.argv[3] if len(sys.argv) > 3 else None
+        for row in store.top(n, music):
+            print(*row, sep=', ')
+    elif command == 'history':
+        for run in store.player_history(sys.argv[2]):
+            print(run)
+    else:
+        print(__doc__)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import queue
+import threading
+import time
+
+import serial  # For serial communication with Arduino
+import serial.tools.list_ports
+
+# Lines sent by controller_python_vg.ino and the direction they stand for
+SERIAL_DIRECTIONS = {'UP': 'up', 'DOWN': 'down', 'LEFT': 'left', 'RIGHT': 'right'}
+# Time between two connection attempts when the Arduino is unplugged (s)
+RECONNECT_DELAY = 2.0
+
+
+def discover_ports():
+    """Serial ports of the USB devices plugged in (the Arduino controllers), sorted by name."""
+    # Built-in serial ports (COM1, /dev/ttyS0...) have no USB vendor id
+    return sorted(port.device for port in serial.tools.list_ports.comports() if port.vid is not None)
+
+
+class SerialReader(threading.Thread):
+    """Reads the Arduino controller in a background thread.
+
+    Every button press is stamped with time.perf_counter() as soon as its line
+    is complete and put on a queue, the game drains that queue once per frame.
+    The port is (re)opened automatically whenever the Arduino is plugged in.
+    """
+
+    def __init__(self, port, baud_rate):
+        super().__init__(daemon=True)
+        self.port = port
+        self.baud_rate = baud_rate
+        self.events = queue.SimpleQueue()
+        self.connected = False
+        self.stopped = threading.Event()
+
+    def run(self):
+        warned = False
+        while not self.stopped.is_set():
+            try:
+                connection = serial.Serial(self.port, self.baud_rate, timeout=0.05)
+            except serial.SerialException:
+                if not warned:
+                    print("Arduino not connected. Serial inputs will be ignored until it is plugged in.")
+                    warned = True
+                self.stopped.wait(RECONNECT_DELAY)
+                continue
+            warned = False
+            # Unplugging raises SerialException, or a plain OSError on POSIX (in_waiting, write, close)
+            try:
+                with connection:
+                    connection.write(b"Hello from Python!\n")
+                    print("connection made on ", self.port, " with a Baud rate of ", self.baud_rate)
+                    self.connected = True
+                    self.read_lines(connection)
+            except (serial.SerialException, OSError):
+                print("Arduino disconnected from", self.port)
+            self.connected = False
+
+    def read_lines(self, connection):
+        buffer = b""
+        while not self.stopped.is_set():
+            # Wait for at least one byte (or the timeout), then take everything available
+            data = connection.read(connection.in_waiting or 1)
+            arrival_time = time.perf_counter()
+            if not data:
+                continue
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                direction = SERIAL_DIRECTIONS.get(line.decode('utf-8', errors='ignore').strip())
+                if direction:
+                    self.events.put((arrival_time, direction))
+
+    def drain(self):
+        """Return every (perf_counter time, direction) press received since the last call."""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,217 @@
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from results_store import append_player_csv
+
+JOURNAL_DIR = 'sessions'
+# Time the writer waits for more records before writing and syncing them together (s)
+FLUSH_INTERVAL = 0.5
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class SessionJournal(threading.Thread):
+    """Writes the events of the runs to disk in a background thread.
+
+    Each run gets a journal, sessions/<session id>.open.jsonl, with one JSON
+    record per line: 'start', then 'spawn', 'hit' and 'loop' events while the
+    run goes on, and 'end' with the summary of the run. The game only puts the
+    records on a queue; the writer appends them in batches and fsyncs once per
+    batch. When a run ends, the writer saves it in the results store and the
+    player's CSV file, then renames the journal to <session id>.jsonl.
+    Journals still open at startup (crash, power loss, window closed during a
+    run) are saved from their records.
+    """
+
+    def __init__(self, results=None, folder=JOURNAL_DIR, players_folder='players', flush_interval=FLUSH_INTERVAL):
+        super().__init__(daemon=True)
+        self.results = results  # ResultsStore
+        self.leaderboard = None  # LeaderboardClient, the runs are also sent to the leaderboard server
+        self.folder = folder
+        self.players_folder = players_folder
+        self.flush_interval = flush_interval
+        self.records = queue.SimpleQueue()
+        self.stopped = threading.Event()
+        self.files = {}
+        self.failed_sessions = set()  # Sessions whose journal could not be written, reported once
+
+    def start(self):
+        os.makedirs(self.folder, exist_ok=True)
+        super().start()
+        # Write what is still queued when the game exits
+        atexit.register(self.stop)
+
+    def journal_path(self, session_id, finished=False):
+        return os.path.join(self.folder, f"{session_id}.jsonl" if finished else f"{session_id}.open.jsonl")
+
+    def begin_session(self, name, music, start_time):
+        session_id = f"{start_time.strftime('%Y%m%d-%H%M%S')}_{name}_{uuid.uuid4().hex[:8]}"
+        self.log(session_id, {'event': 'start', 'name': name, 'music': music,
+                              'start_time': start_time.strftime(DATE_FORMAT)})
+        return session_id
+
+    def log(self, session_id, record):
+        self.records.put((session_id, record, ()))
+
+    def end_session(self, session_id, run, exports=()):
+        # exports: functions writing the other files of the run (trace, event log), called by the writer
+        self.records.put((session_id, {'event': 'end', 'run': run}, exports))
+
+    def run(self):
+        self.recover()
+        while not self.stopped.is_set():
+            batch = [self.records.get()]
+            # Let the records of the next frames arrive, they are synced together
+            self.stopped.wait(self.flush_interval)
+            while True:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            self.write(batch)
+
+    def write(self, batch):
+        touched = {}
+        ended = []
+        for session_id, record, exports in batch:
+            if session_id is None:  # Sent by stop()
+                continue
+            if record['event'] == 'end':
+                ended.append((session_id, record['run'], exports))
+            try:
+                file = self.files.get(session_id)
+                if file is None:
+                    file = self.files[session_id] = open(self.journal_path(session_id), 'a')
+                file.write(json.dumps(record) + "\n")
+                touched[session_id] = file
+            except OSError as error:
+                self.journal_failed(session_id, error)
+        for session_id, file in touched.items():
+            try:
+                file.flush()
+                os.fsync(file.fileno())
+            except OSError as error:
+                self.journal_failed(session_id, error)
+        # The summary is only saved once the end record is on disk (or the journal can't be written)
+        for session_id, run, exports in ended:
+            self.close_journal(session_id)
+            self.failed_sessions.discard(session_id)
+            for export in exports:
+                try:
+                    export()
+                except Exception as error:
+                    # Any error of numpy, pyarrow... only that file is missing, the run itself is still saved
+                    print("Could not export session", session_id, ":", repr(error))
+            try:
+                self.finish(session_id, run)
+            except (OSError, TimeoutError, sqlite3.Error) as error:
+                # The journal stays open, the run will be saved on the next startup
+                print("Could not save session", session_id, ":", error)
+
+    def journal_failed(self, session_id, error):
+        # Disk full, permissions...: the writer goes on, the run is still saved when it ends
+        if session_id not in self.failed_sessions:
+            print("Could not write the journal of session", session_id, ":", error)
+            self.failed_sessions.add(session_id)
+        # Opened again for the next records, in case the disk is writable again by then
+        self.close_journal(session_id)
+
+    def close_journal(self, session_id):
+        file = self.files.pop(session_id, None)
+        if file is not None:
+            try:
+                file.close()
+            except OSError:
+                pass
+
+    def finish(self, session_id, run):
+        # The store ignores a session it already has, so a run is never saved twice
+        if self.results is None or self.results.insert_run(run, session_id) is not None:
+            append_player_csv(run, self.players_folder)
+        if self.leaderboard is not None:
+            # Queued even if the run was already saved here, the server ignores the sessions it has
+            self.leaderboard.submit(session_id, run)
+        if os.path.exists(self.journal_path(session_id)):  # Missing if it could never be written
+            os.replace(self.journal_path(session_id), self.journal_path(session_id, finished=True))
+
+    def recover(self):
+        """Save the runs of the journals left open by a previous start."""
+        for filename in sorted(os.listdir(self.folder)):
+            if not filename.endswith('.open.jsonl'):
+                continue
+            session_id = filename[:-len('.open.jsonl')]
+            records = read_journal(os.path.join(self.folder, filename))
+            run = summary_from_records(records)
+            if run is None:
+                # The run did not even start, nothing to save
+                os.remove(os.path.join(self.folder, filename))
+                continue
+            try:
+                self.finish(session_id, run)
+                print("Recovered session", session_id)
+            except (OSError, TimeoutError, sqlite3.Error) as error:
+                print("Could not recover session", session_id, ":", error)
+
+    def stop(self):
+        if self.is_alive():
+            self.stopped.set()
+            self.records.put((None, None, ()))
+            self.join(timeout=5)
+        if not self.is_alive():
+            # The thread may have stopped before the last records arrived
+            batch = []
+            while True:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                self.write(batch)
+
+
+def read_journal(path):
+    records = []
+    with open(path) as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break  # Last line cut by the crash
+    return records
+
+
+def summary_from_records(records):
+    """Summary of a run (dict with the RUN_COLUMNS keys) from its journal records."""
+    if not records or records[0]['event'] != 'start':
+        return None
+    if records[-1]['event'] == 'end':
+        return records[-1]['run']
+    # Run interrupted: rebuild what the game would have saved at game over
+    start = records[0]
+    hits = [record for record in records if record['event'] == 'hit']
+    loops = [record for record in records if record['event'] == 'loop']
+    last_time = records[-1].get('time', 0)
+    start_time = datetime.strptime(start['start_time'], DATE_FORMAT)
+    end_time = start_time + timedelta(milliseconds=last_time)
+    reaction_times = [hit['reaction_time'] for hit in hits]
+    run = {
+        'name': start['name'],
+        'score': sum(hit['score'] for hit in hits) + sum(loop['bonus'] for loop in loops),
+        'total_blocks': len(hits),
+        'just_in_time': sum(hit['distance_class'] == 'just_in_time' for hit in hits),
+        'normal': sum(hit['distance_class'] == 'normal' for hit in hits),
+        'too_early': sum(hit['distance_class'] == 'too_early' for hit in hits),
+        'start_time': start['start_time'],
+        'end_time': end_time.strftime(DATE_FORMAT),
+        'duration': last_time / 1000,
+        'music': start['music'],
+        'average_reaction_time': sum(reaction_times) / len(reaction_times) if reaction_times else 0,
+    }
+    for direction in ['up', 'down', 'left', 'right']:
+        run[direction] = sum(hit['direction'] == direction for hit in hits)
+    return run
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+
+import pygame
+
+# --- Configuration ---
+
+# Folder holding the packed atlas of the last run and its manifest
+CACHE_DIR = '.sprite_cache'
+# Width of the atlas surface, sprites are packed in rows (shelves) inside it
+ATLAS_WIDTH = 1024
+
+# Sprites already loaded in this process, keyed by specs_key
+_loaded_sprites = {}
+
+
+def sprite_name(name, angle=0):
+    return f"{name}@{angle}"
+
+
+def specs_key(specs):
+    """Key of a list of sprite specs, changes when a source image or a size/angle changes."""
+    digest = hashlib.sha1(pygame.version.ver.encode())
+    for name, path, size, angles in specs:
+        stat = os.stat(path)
+        digest.update(repr((name, path, stat.st_mtime_ns, stat.st_size, tuple(size), tuple(angles))).encode())
+    return digest.hexdigest()
+
+
+def render_sprites(specs):
+    # Decode, scale and rotate every sprite once
+    sprites = {}
+    for name, path, size, angles in specs:
+        image = pygame.transform.scale(pygame.image.load(path).convert_alpha(), size)
+        for angle in angles:
+            sprites[sprite_name(name, angle)] = pygame.transform.rotate(image, angle) if angle else image
+    return sprites
+
+
+def pack_atlas(sprites):
+    """Blit all the sprites into a single surface, returns it with the rect of each sprite."""
+    rects = {}
+    x = y = shelf_height = 0
+    for name, sprite in sprites.items():
+        width, height = sprite.get_size()
+        if x + width > ATLAS_WIDTH:
+            x, y = 0, y + shelf_height
+            shelf_height = 0
+        rects[name] = pygame.Rect(x, y, width, height)
+        x += width
+        shelf_height = max(shelf_height, height)
+    atlas = pygame.Surface((ATLAS_WIDTH, max(1, y + shelf_height)), pygame.SRCALPHA)
+    for name, sprite in sprites.items():
+        atlas.blit(sprite, rects[name])
+    return atlas, rects
+
+
+def save_atlas(key, atlas, rects):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    pixels_path = os.path.join(CACHE_DIR, 'atlas.rgba')
+    with open(pixels_path + '.tmp', 'wb') as file:
+        file.write(pygame.image.tobytes(atlas, 'RGBA'))
+    os.replace(pixels_path + '.tmp', pixels_path)
+    manifest = {'key': key, 'size': atlas.get_size(), 'rects': {name: list(rect) for name, rect in rects.items()}}
+    manifest_path = os.path.join(CACHE_DIR, 'atlas.json')
+    with open(manifest_path + '.tmp', 'w') as file:
+        json.dump(manifest, file)
+    # The manifest is written last, so it never describes a half written atlas
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def load_cached_atlas(key):
+    try:
+        with open(os.path.join(CACHE_DIR, 'atlas.json')) as file:
+            manifest = json.load(file)
+        if manifest['key'] != key:
+            return None
+        with open(os.path.join(CACHE_DIR, 'atlas.rgba'), 'rb') as file:
+            atlas = pygame.image.frombytes(file.read(), tuple(manifest['size']), 'RGBA')
+    except (FileNotFoundError, KeyError, ValueError, OSError):
+        return None
+    rects = {name: pygame.Rect(rect) for name, rect in manifest['rects'].items()}
+    return atlas.convert_alpha(), rects
+
+
+def load_sprites(specs, use_disk_cache=True):
+    """Return {sprite_name(name, angle): surface} for every (name, path, size, angles) spec.
+
+    Every surface is a subsurface of one atlas. The atlas is read back from CACHE_DIR when
+    the sources didn't change, which skips the PNG decoding and the scaling.
+    """
+    key = specs_key(specs)
+    # Games of the same process (station mode) share the atlas
+    if key in _loaded_sprites:
+        return _loaded_sprites[key]
+    cached = load_cached_atlas(key) if use_disk_cache else None
+    if cached is None:
+        atlas, rects = pack_atlas(render_sprites(specs))
+        if use_disk_cache:
+            save_atlas(key, atlas, rects)
+    else:
+        atlas, rects = cached
+    _loaded_sprites[key] = {name: atlas.subsurface(rect) for name, rect in rects.items()}
+    return _loaded_sprites[key]
@@ -0,0 +1,179 @@
+"""Station mode: several players play the same music at once, each on their own controller.
+
+    python stations.py                       # one station per Arduino found
+    python stations.py --stations 2          # 2 stations, keyboard: arrows for the first one, ZQSD for the second
+    python stations.py --ports COM3 COM4 --names alice bob --music unchained.mp3
+
+The window is split in one viewport per station, scaled down when they don't all
+fit on the display at their full size. All the stations run in this
+process: they share the music, the beat maps, the sprites and the results
+store, and every run is saved under the name of its station.
+"""
+import argparse
+import math
+import os
+
+import pygame
+
+import test12
+from leaderboard_client import LeaderboardClient
+from renderer import present
+from results_store import ResultsStore
+from serial_input import SerialReader, discover_ports
+from test12 import BAUD_RATE, HEIGHT, WIDTH, Game, render_text
+
+# Keyboard keys of the first two stations, to play without controllers
+STATION_KEYS = [
+    {pygame.K_UP: 'up', pygame.K_DOWN: 'down', pygame.K_LEFT: 'left', pygame.K_RIGHT: 'right'},
+    {pygame.K_z: 'up', pygame.K_s: 'down', pygame.K_q: 'left', pygame.K_d: 'right'},
+]
+
+
+# Height of the display kept for the title bar and the task bar (pixels)
+DISPLAY_MARGIN = 80
+
+
+class NoWaitClock:
+    """Clock of the station games, the station loop ticks the real clock once per frame for all of them."""
+
+    def tick(self, framerate=0):
+        return 0
+
+
+class Stations:
+    def __init__(self, ports, names):
+        count = len(names)
+        self.columns = math.ceil(math.sqrt(count))
+        self.rows = math.ceil(count / self.columns)
+        # The stations are scaled down to fit the display (3 or 4 stations at 1x need 1600x1200)
+        pygame.display.init()
+        display = pygame.display.Info()
+        self.scale = 1.0
+        if display.current_w > 0 and display.current_h > DISPLAY_MARGIN:
+            self.scale = min(1.0, display.current_w / (self.columns * WIDTH),
+                             (display.current_h - DISPLAY_MARGIN) / (self.rows * HEIGHT))
+        viewport_size = (int(WIDTH * self.scale), int(HEIGHT * self.scale))
+        test12.init_pygame(size=(self.columns * viewport_size[0], self.rows * viewport_size[1]))
+        self.clock = pygame.time.Clock()
+        self.results = ResultsStore()
+        self.results.import_csv_once()
+        self.games = []
+        self.readers = []
+        for index, name in enumerate(names):
+            game = Game(music=self.games[0].music if self.games else None, clock=NoWaitClock())
+            game.name = name
+            viewport = pygame.Rect(((index % self.columns) * viewport_size[0], (index // self.columns) * viewport_size[1]),
+                                   viewport_size)
+            if self.scale < 1:
+                # Drawn at 1x off screen, then scaled into its viewport (see renderer.present)
+                game.surface = pygame.Surface((WIDTH, HEIGHT)).convert()
+                game.viewport = viewport
+            else:
+                game.surface = test12.screen.subsurface(viewport)
+            game.owns_music = False
+            game.key_directions = STATION_KEYS[index] if index < len(STATION_KEYS) else {}
+            game.results = self.results
+            # The first station loads the beats, the others read them from it
+            game.beat_source = self.games[0] if self.games else game
+            if index < len(ports):
+                game.serial_reader = SerialReader(ports[index], BAUD_RATE)
+                self.readers.append(game.serial_reader)
+            if self.games:
+                # One journal writes the runs of every station
+                game.journal = self.games[0].journal
+            self.games.append(game)
+        self.lead = self.games[0]
+        self.lead.journal.results = self.results
+
+    def start(self, music_list):
+        # The stations without a port keep a reader that is never started, they only use the keyboard
+        for reader in self.readers:
+            reader.start()
+        self.lead.journal.start()
+        self.lead.music_list = music_list
+        self.lead.start_analysis()
+
+    def play_round(self, music):
+        """Play one round on a music, until every station is game over."""
+        music_file = os.path.join('musics', music)
+        for game in self.games:
+            game.music_file = music_file
+        # The lead game loads the beats and starts the music for everyone, with the loading screen over the whole window
+        if not self.lead.start_run():
+            return False
+        for game in self.games[1:]:
+            # Their beats are read from the lead game as it streams them (see Game.simulation_step)
+            game.start_run(self.lead.beat_timestamps, start_music=False)
+        playing = list(self.games)
+        while playing:
+            events = []
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                    # The runs in progress are saved as they are
+                    for game in playing:
+                        game.finish_run()
+                    self.lead.music.stop()
+                    self.lead.beat_loader_stop.set()
+                    return False
+                # No pause in the station mode, the music goes on for everyone
+                if not (event.type == pygame.KEYDOWN and event.key == pygame.K_p):
+                    events.append(event)
+            for game in playing[:]:
+                if game.run_frame(events):
+                    playing.remove(game)
+                    self.draw_game_over(game)
+            self.clock.tick(test12.RENDER_FPS)
+        self.lead.music.stop()
+        self.lead.beat_loader_stop.set()
+        return True
+
+    def draw_game_over(self, game):
+        game.surface.fill((0, 0, 0))
+        game.surface.blit(render_text(f"{game.name}: Game Over"), (WIDTH // 2 - 120, HEIGHT // 2 - 40))
+        game.surface.blit(render_text(f"Score: {game.score}"), (WIDTH // 2 - 120, HEIGHT // 2))
+        present(game.surface, [game.surface.get_rect()], game.viewport)
+
+    def wait_next_round(self):
+        # Enter: play again, Escape: quit
+        message = render_text("Enter: new round   Escape: quit")
+        test12.screen.blit(message, (10, test12.screen.get_height() - 40))
+        pygame.display.flip()
+        while True:
+            for event in test12.wait_events():
+                if event.type == pygame.QUIT:
+                    return False
+                if event.type == pygame.KEYDOWN and event.key in (pygame.K_RETURN, pygame.K_ESCAPE):
+                    return event.key == pygame.K_RETURN
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ports', nargs='*', help='serial ports of the controllers (default: every USB serial port)')
+    parser.add_argument('--stations', type=int, help='number of stations (default: one per port, at least 1)')
+    parser.add_argument('--names', nargs='*', default=[], help='player name of each station')
+    parser.add_argument('--music', help='music of the rounds (default: the first one of the musics folder)')
+    parser.add_argument('--leaderboard', default=test12.LEADERBOARD_URL, metavar='URL',
+                        help='leaderboard server shared by the booths (see leaderboard_server.py)')
+    args = parser.parse_args()
+
+    ports = discover_ports() if args.ports is None else args.ports
+    count = args.stations or max(len(ports), 1)
+    names = args.names[:count] + [f"station{index + 1}" for index in range(len(args.names), count)]
+    print("Stations:", ", ".join(f"{name} ({ports[index] if index < len(ports) else 'keyboard'})"
+                                 for index, name in enumerate(names)))
+    music_list = sorted(f for f in os.listdir('musics') if f.endswith('.mp3'))
+    music = args.music or music_list[0]
+
+    stations = Stations(ports, names)
+    if args.leaderboard:
+        stations.lead.journal.leaderboard = LeaderboardClient(args.leaderboard)
+        stations.lead.journal.leaderboard.start()
+    stations.start(music_list)
+    while stations.play_round(music) and stations.wait_next_round():
+        pass
+    stations.lead.analyzer.terminate()
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,27 @@
+import time
+IMPORT_START = time.perf_counter()  # --profile-startup counts the imports from here
 import pygame
-import csv
 import random
+import numpy as np
 from datetime import datetime
-import librosa
+import argparse
 import threading
 import os
-import serial  # For serial communication with Arduino
+from collections import deque
+from functools import partial
+import asset_bundle
+import audio_cache
+import beat_cache
+import music_analysis
+import sprite_cache
+from audio_cache import CachedMusic
+from renderer import DirtyRenderer
+from serial_input import SerialReader
+from event_log import EVENTS_DIR, EventLog, save_events
+from leaderboard_client import LeaderboardClient
+from instrumentation import GameStats, StartupProfile, save_trace
+from results_store import ResultsStore
+from session_journal import SessionJournal
 
 # --- Configuration ---
 
@@ -13,27 +29,49 @@ import serial  # For serial communication with Arduino
 SERIAL_PORT = 'COM3'  # Replace with your Arduino's serial port
 BAUD_RATE = 115200
 
-# Initialize serial communication
-try:
-    ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-    ser.write(b"Hello from Python!\n")
-    answer = ser.readline()
-    print(answer.decode())
-    print("connection made on ",SERIAL_PORT," with a Baud rate of ", BAUD_RATE)
-except serial.SerialException:
-    ser = None
-    print("Arduino not connected. Serial inputs will be ignored.")
-
-# Initialize Pygame
-pygame.init()
+# Leaderboard server shared by the booths (see leaderboard_server.py), e.g. 'http://192.168.1.10:8765'.
+# None: the leaderboard only shows the runs of this computer
+LEADERBOARD_URL = None
+
+# Start playing a music that isn't analysed yet while its beats are still being
+# detected (block by block), instead of waiting for the full analysis. Off by
+# default: the detection runs in a thread of the game and slows the frames down (GIL)
+STREAMING_ANALYSIS = False
+
 WIDTH, HEIGHT = 800, 600
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Rhythm Game: Directional Defense")
-clock = pygame.time.Clock()
 
-# Colors and font
+# Simulation runs in fixed steps of game time (the enemy speeds are in pixels per step),
+# so gameplay doesn't depend on the frame rate
+SIMULATION_STEP_MS = 1000 / 60
+# Most steps simulated before a frame is drawn, the rest is caught up on the next frames
+MAX_STEPS_PER_FRAME = 30
+RENDER_FPS = 60
+# Show the FPS and frame times in game (toggled with F3)
+SHOW_PERF_OVERLAY = False
+
+# Tier of the asset bundle the game draws (see asset_bundle.py), the game is played at 1x (800x600)
+ASSET_TIER = '1x'
+
+# Colors
 WHITE = (255, 255, 255)
-FONT = pygame.font.Font(None, 36)
+
+# Keys of the keyboard and the direction they defend (arrows or ZQSD)
+KEY_DIRECTIONS = {pygame.K_UP: 'up', pygame.K_z: 'up', pygame.K_DOWN: 'down', pygame.K_s: 'down',
+                  pygame.K_LEFT: 'left', pygame.K_q: 'left', pygame.K_RIGHT: 'right', pygame.K_d: 'right'}
+
+# Format of the replays saved next to the players' CSV files (see replay.py)
+REPLAY_VERSION = 2
+
+# Longest time the menus sleep waiting for an event before refreshing
+MENU_IDLE_MS = 250
+# Colors of the analysis status shown next to each music ('analysing' otherwise)
+STATUS_COLORS = {'ready': (0, 200, 0), 'failed': (200, 0, 0)}
+LOADING_COLOR = (200, 200, 0)
+
+# Window and font, created by init_pygame() (the music analysis workers
+# re-import this file, they must not open a window)
+screen = None
+FONT = None
 
 # --- Classes ---
 
@@ -45,65 +83,185 @@ class Player:
         self.color = (0, 0, 0)  # Color not used as we display a sprite
         self.image = None  # To be loaded in Game class
 
-class Enemy:
-    def __init__(self, direction, speed, image):
-        self.direction = direction
-        self.speed = speed
-        self.active = True
-        self.image = image
-        if direction == 'up':
-            self.x = WIDTH //2
-            self.y = 0
-        elif direction == 'down':
-            self.x = WIDTH //2
-            self.y = HEIGHT
-        elif direction == 'left':
-            self.x = 0
-            self.y =  HEIGHT //2
-        elif direction == 'right':
-            self.x = WIDTH
-            self.y = HEIGHT //2
-        self.angle = self.get_angle_from_direction(direction)
-        self.rotated_image = pygame.transform.rotate(self.image, self.angle)
-        self.rect = self.rotated_image.get_rect(center=(self.x, self.y))
-        self.spawn_time = pygame.time.get_ticks()
-
-
-    def get_angle_from_direction(self, direction):
-        if direction == 'up':
-            return -90
-        elif direction == 'right':
-            return 180
-        elif direction == 'down':
-            return 90
-        elif direction == 'left':
-            return 0
+# Spawn position and sprite angle of the enemies coming from each direction
+DIRECTIONS = ['up', 'down', 'left', 'right']
+ENEMY_SPAWN_POSITIONS = {'up': (WIDTH // 2, 0), 'down': (WIDTH // 2, HEIGHT),
+                         'left': (0, HEIGHT // 2), 'right': (WIDTH, HEIGHT // 2)}
+ENEMY_ANGLES = {'up': -90, 'right': 180, 'down': 90, 'left': 0}
+# Rotation of the player sprite defending each direction
+PLAYER_ANGLES = {'up': 90, 'right': 0, 'down': -90, 'left': 180}
+
+class EnemyPool:
+    """All the enemies of a run, stored in NumPy arrays (one slot per enemy).
+
+    Killed enemies free their slot for the next spawn, so the arrays only grow
+    up to the number of enemies alive at the same time.
+    """
+
+    def __init__(self, capacity=64):
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        # Positions at the previous simulation step, used to interpolate the drawing
+        self.previous_x = np.zeros(capacity)
+        self.previous_y = np.zeros(capacity)
+        self.speed = np.zeros(capacity)
+        self.direction = np.zeros(capacity, dtype=np.int8)  # Index in DIRECTIONS
+        self.active = np.zeros(capacity, dtype=bool)
+        self.spawn_time = np.zeros(capacity)  # Game time (ms)
+        self.beat = np.zeros(capacity, dtype=np.int32)  # Index of the spawning beat in the beat map
+        self.free_slots = list(range(capacity - 1, -1, -1))
+
+    def grow(self):
+        capacity = len(self.x)
+        for name in ('x', 'y', 'previous_x', 'previous_y', 'speed', 'direction', 'active', 'spawn_time', 'beat'):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+        self.free_slots.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    def clear(self):
+        self.active[:] = False
+        self.free_slots = list(range(len(self.x) - 1, -1, -1))
+
+    def spawn(self, direction, speed, spawn_time, beat=-1):
+        if not self.free_slots:
+            self.grow()
+        slot = self.free_slots.pop()
+        self.x[slot], self.y[slot] = ENEMY_SPAWN_POSITIONS[direction]
+        self.previous_x[slot], self.previous_y[slot] = self.x[slot], self.y[slot]
+        self.speed[slot] = speed
+        self.direction[slot] = DIRECTIONS.index(direction)
+        self.active[slot] = True
+        self.spawn_time[slot] = spawn_time
+        self.beat[slot] = beat
+        return slot
+
+    def kill(self, slots):
+        self.active[slots] = False
+        self.free_slots.extend(int(slot) for slot in slots)
+
+    def distances(self, player):
+        # Distance of every slot to the player, infinite for the free slots
+        distance = np.hypot(player.x - self.x, player.y - self.y)
+        distance[~self.active] = np.inf
+        return distance
 
     def update(self, player, speed_multiplier=1.0):
-        dx = player.x - self.x
-        dy = player.y - self.y
-        dist = (dx**2 + dy**2) ** 0.5
-        self.x += (dx / dist) * self.speed * speed_multiplier
-        self.y += (dy / dist) * self.speed * speed_multiplier
-        self.rect.center = (self.x, self.y)
-
-    def draw(self, screen):
-        screen.blit(self.rotated_image, self.rect)
+        # Move every active enemy towards the player, by one simulation step
+        active = self.active
+        self.previous_x[active] = self.x[active]
+        self.previous_y[active] = self.y[active]
+        dx = player.x - self.x[active]
+        dy = player.y - self.y[active]
+        step = self.speed[active] * speed_multiplier / np.maximum(np.hypot(dx, dy), 1e-9)
+        self.x[active] += dx * step
+        self.y[active] += dy * step
+
+    def draw(self, screen, images, alpha=1.0):
+        # images: the enemy sprite already rotated for each direction, in DIRECTIONS order
+        # alpha: how far the game time is between the last two simulation steps
+        slots = np.flatnonzero(self.active)
+        x = self.previous_x[slots] + (self.x[slots] - self.previous_x[slots]) * alpha
+        y = self.previous_y[slots] + (self.y[slots] - self.previous_y[slots]) * alpha
+        blits = []
+        for slot, center in zip(slots, zip(x, y)):
+            image = images[self.direction[slot]]
+            blits.append((image, image.get_rect(center=center)))
+        screen.blits(blits, doreturn=False)
+
+class AudioClock:
+    """Game time in ms, driven by the position of the music.
+
+    The music loops without stopping and music.get_pos() counts the time of
+    every loop, the start time of the current loop is kept in loop_offset.
+    Between two updates of the audio position the time is extrapolated with
+    the system clock. The music and the clocks can be replaced, for the
+    headless mode.
+    """
+
+    def __init__(self, music, ticks=pygame.time.get_ticks, counter=time.perf_counter):
+        self.music = music
+        self.ticks = ticks
+        self.counter = counter
+        self.reset()
+
+    def reset(self):
+        self.time = 0.0
+        self.loop_offset = 0.0
+        self.last_position = 0
+        self.last_ticks = self.ticks()
+        self.update_counter = self.counter()
+
+    def new_loop(self, length):
+        # The music started its next loop, length ms after the previous one
+        self.loop_offset += length
+
+    def update(self):
+        position = self.music.get_pos()
+        ticks = self.ticks()
+        self.update_counter = self.counter()
+        if position < 0:
+            return self.time
+        if position != self.last_position:
+            self.last_position = position
+            self.last_ticks = ticks
+        # Extrapolate a little bit at most (the position doesn't move while paused)
+        position += min(ticks - self.last_ticks, 50)
+        # Never go back in time
+        self.time = max(self.time, position)
+        return self.time
+
+    def time_at(self, counter):
+        # Game time at a time.perf_counter() value from before the last update
+        return max(0.0, self.time - (self.update_counter - counter) * 1000)
 
 class Game:
-    def __init__(self):
+    # music, clock and rng can be replaced to run the game without a window or
+    # an audio device (see headless.py)
+    def __init__(self, music=None, clock=None, rng=None, ticks=pygame.time.get_ticks):
+        self.music = music if music is not None else CachedMusic()
+        self.clock = clock if clock is not None else pygame.time.Clock()
+        self.rng = rng if rng is not None else random.Random()  # Draws the seed of each run
+        self.seed = None
+        self.spawn_rng = random.Random()  # Directions of the zombies, seeded at the start of each run
+        self.bot = None  # Called every frame with the game, returns the directions to defend
+        self.surface = screen  # Where the game is drawn, a viewport of the window in the station mode
+        self.viewport = None  # Rect of the window showing self.surface scaled down (see renderer.present)
+        self.owns_music = True  # False when the music is shared with other games (station mode)
+        self.key_directions = KEY_DIRECTIONS
+        self.save_results = True
         self.player = Player()
         self.name = ""
         self.score = 0
-        self.enemies = []
+        self.enemies = EnemyPool()
+        self.serial_reader = SerialReader(SERIAL_PORT, BAUD_RATE)
+        self.pending_inputs = []  # (game time, direction, source, perf_counter arrival) not handled yet
+        self.scripted_inputs = deque()  # (step, game time, direction) of a replay, handled at their step
+        self.input_log = []  # (step, game time, direction index) of every input handled in the run
+        self.scripted_spawns = None  # (step, beat) of the zombies of a replay, spawned at their step instead of on the beats
+        self.spawn_log = []  # (step, beat) of every zombie spawned in the run
+        self.stats = GameStats()
+        self.events = EventLog()
+        self.show_perf_overlay = SHOW_PERF_OVERLAY
+        self.perf_text = ""
+        self.ticks = ticks  # Clock of the explosion animations, virtual in the headless runs
+        self.audio_clock = AudioClock(self.music, ticks)
         self.death_marks = []
         self.game_paused = False
-        self.leaderboard_file = 'leaderboard.csv'
+        self.leaderboard_file = 'leaderboard.csv'  # Only read once, to import it in the results store
+        self.results = None  # ResultsStore, opened in main()
+        self.leaderboard = None  # LeaderboardClient, when a leaderboard server is used
+        self.journal = SessionJournal()  # Writes the runs in the background, started in main()
+        self.session_id = None
         self.current_screen = 'leaderboard'
         self.beat_timestamps = []
+        self.loading_state = 'idle'  # 'loading', 'streaming', 'ready' or 'failed'
+        self.beats_streamed = False
+        self.beat_source = self  # Game loading the beats, the first station for all of them in station mode
+        self.beat_loader_stop = threading.Event()
         self.music_started = False
         self.enemy_spawn_index = 0
         self.music_file = ""
+        self.music_length = 0.0  # Length of one loop of the music (ms)
         self.music_list = []
         self.defense_direction = None
         self.block_counts = {'total': 0, 'just_in_time': 0, 'normal': 0, 'too_early': 0}
@@ -113,60 +271,68 @@ class Game:
         self.reaction_times = []
 
         self.speed_multiplier = 1.0
-        self.background_image = None
-        self.bg_position = (0, 0)
+        self.renderer = None
+        self.background = None
+        self.last_frame = None  # What the menu on screen shows, it is only redrawn when this changes
         self.player_image = None
+        self.player_images = {}
         self.enemy_image = None
+        self.enemy_images = []
         self.explosion_frames = []
-        self.load_sprites()
+        self.analyzer = music_analysis.MusicAnalyzer()
 
     def load_sprites(self):
-        # Load the player's image
-        self.player_image = pygame.image.load('sprites/player.png').convert_alpha()
-        # Resize the player image if necessary
-        self.player_image = pygame.transform.scale(self.player_image, (30, 40))  # Adjust size as needed
+        # Sprites and background baked by asset_bundle.py, read in one go. Without a bundle every
+        # scale and rotation used in game is rendered here (or read back from the sprite cache)
+        bundle = asset_bundle.load_bundle(ASSET_TIER)
+        if bundle is not None:
+            sprites, self.background = bundle
+        else:
+            sprites = sprite_cache.load_sprites(sprite_specs())
+
+        self.player_image = sprites[sprite_cache.sprite_name('player')]
         self.player.image = self.player_image
+        self.player_images = {direction: sprites[sprite_cache.sprite_name('player', self.get_angle_from_direction(direction))]
+                              for direction in DIRECTIONS}
 
-        # Load the enemy's image
-        self.enemy_image = pygame.image.load('sprites/enemy.png').convert_alpha()
-        # Resize the enemy image if necessary
-        self.enemy_image = pygame.transform.scale(self.enemy_image, (60, 60))  # Adjust size as needed
-
-        # Chargement des frames d'explosion individuelles
-        self.explosion_frames = self.load_explosion_frames()
-
-
-    def load_explosion_frames(self):
-        frames = []
-        # Obtenir la liste des fichiers d'explosion dans le dossier 'sprites'
-        explosion_files = [f for f in os.listdir('sprites') if f.endswith('.png') and '-explosion' in f]
-        # Trier les fichiers par ordre numérique
-        explosion_files.sort()
-        for filename in explosion_files:
-            frame = pygame.image.load(os.path.join('sprites', filename)).convert_alpha()
-            # Redimensionner la frame si nécessaire
-            frame = pygame.transform.scale(frame, (60, 60))  # Ajuster la taille selon les besoins
-            frames.append(frame)
-        return frames
+        self.enemy_image = sprites[sprite_cache.sprite_name('enemy')]
+        self.enemy_images = [sprites[sprite_cache.sprite_name('enemy', ENEMY_ANGLES[direction])] for direction in DIRECTIONS]
 
+        # Chargement des frames d'explosion individuelles, dans l'ordre numérique des fichiers
+        self.explosion_frames = [sprites[name] for name in sorted(sprites) if '-explosion' in name]
 
     def load_music_list(self):
         # Load available music files
         self.music_list = [f for f in os.listdir('musics') if f.endswith('.mp3')]
 
+    def start_analysis(self):
+        # Analyse the musics not analysed yet in the background while the player is in the menus
+        self.analyzer.start(self.music_list)
+        if STREAMING_ANALYSIS and self.analyzer.pool is not None:
+            # Compile librosa's beat tracker now so streaming a new music starts quickly. Without
+            # streaming, librosa is only used by the worker processes, never imported here
+            threading.Thread(target=music_analysis.warm_up, daemon=True).start()
+
     def select_music(self):
         # Music selection menu
         selected = 0
         while True:
-            screen.fill((0, 0, 0))
-            display_text("Select a music:", WIDTH // 4, 50, WHITE)
-            for idx, music in enumerate(self.music_list):
-                color = (0, 255, 0) if idx == selected else WHITE
-                display_text(music, WIDTH // 4, 100 + idx * 40, color)
-            display_text("Use UP/DOWN to navigate, ENTER to select", WIDTH // 4, HEIGHT - 50, WHITE)
-            pygame.display.flip()
-
-            for event in pygame.event.get():
+            # Refresh music_info.csv as soon as the background analysis is over
+            self.analyzer.write_music_info()
+            statuses = [self.analyzer.status(os.path.join('musics', music)) for music in self.music_list]
+            frame = ('select_music', selected, tuple(statuses))
+            if frame != self.last_frame:
+                screen.fill((0, 0, 0))
+                display_text("Select a music:", WIDTH // 4, 50, WHITE)
+                for idx, music in enumerate(self.music_list):
+                    color = (0, 255, 0) if idx == selected else WHITE
+                    display_text(music, WIDTH // 4, 100 + idx * 40, color)
+                    display_text(statuses[idx], WIDTH * 3 // 4, 100 + idx * 40, STATUS_COLORS.get(statuses[idx], LOADING_COLOR))
+                display_text("Use UP/DOWN to navigate, ENTER to select", WIDTH // 4, HEIGHT - 50, WHITE)
+                pygame.display.flip()
+                self.last_frame = frame
+
+            for event in wait_events():
                 if event.type == pygame.QUIT:
                     pygame.quit()
                     exit()
@@ -178,89 +344,146 @@ class Game:
                     elif event.key == pygame.K_RETURN:
                         self.music_file = os.path.join('musics', self.music_list[selected])
                         return 'name_input'
-            clock.tick(30)
+            self.clock.tick(30)
+
+    def load_game_background(self, image_path):
+        # Black screen with the centered background image, everything that doesn't move in game
+        background = pygame.Surface((WIDTH, HEIGHT)).convert()
+        background.fill((0, 0, 0))
+        background_image, bg_position = self.load_and_center_background(image_path)
+        background.blit(background_image, bg_position)
+        return background
 
     def load_and_center_background(self, image_path):
         background_image = pygame.image.load(image_path).convert()
-        image_width, image_height = background_image.get_size()
-        scale_ratio = max(WIDTH / image_width, HEIGHT / image_height)
-        new_width = int(image_width * scale_ratio)
-        new_height = int(image_height * scale_ratio)
-        resized_image = pygame.transform.scale(background_image, (new_width, new_height))
-        x_position = (WIDTH - new_width) // 2 +20
-        y_position = (HEIGHT - new_height) // 2 -30
-        return resized_image, (x_position, y_position)
+        size, position = asset_bundle.background_layout(background_image.get_size(), (WIDTH, HEIGHT))
+        return pygame.transform.scale(background_image, size), position
 
     def get_beat_timestamps(self):
-        y, sr = librosa.load(self.music_file, sr=None)
-        tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
-        beat_times = librosa.frames_to_time(beat_frames, sr=sr)
-        beat_times_ms = [int(time * 1000) for time in beat_times]
+        # Reuse the beat map of a previous run when the track hasn't changed
+        beat_times_ms = beat_cache.load_beats(self.music_file)
+        if beat_times_ms is None:
+            # Wait for the background analysis of this track to finish
+            self.analyzer.wait(self.music_file)
+            beat_times_ms = beat_cache.load_beats(self.music_file)
+        if beat_times_ms is None:
+            music_analysis.analyze_track(self.music_file)
+            beat_times_ms = beat_cache.load_beats(self.music_file)
         return beat_times_ms
 
-    def save_score_csv(self):
-        # Create 'players' folder if it doesn't exist
-        os.makedirs('players', exist_ok=True)
-        # Path to the player's CSV file
-        player_file = os.path.join('players', f'{self.name}.csv')
-        file_exists = os.path.isfile(player_file)
+    def start_beat_loading(self):
+        # Stop the loader of the previous run, it may still be streaming its music
+        self.beat_loader_stop.set()
+        self.beat_loader_stop = threading.Event()
+        self.beat_timestamps = beat_cache.load_beats(self.music_file) or []
+        self.beats_streamed = False
+        if self.beat_timestamps:
+            self.loading_state = 'ready'
+            return
+        self.beats_streamed = STREAMING_ANALYSIS
+        self.loading_state = 'streaming' if STREAMING_ANALYSIS else 'loading'
+        target = self.stream_beat_timestamps if STREAMING_ANALYSIS else self.load_beat_timestamps
+        threading.Thread(target=target, args=(self.beat_loader_stop,), daemon=True).start()
+
+    def beats_loading(self):
+        # While streaming, the run can start as soon as the first beats are found
+        return self.loading_state == 'loading' or (self.loading_state == 'streaming' and not self.beat_timestamps)
+
+    def load_beat_timestamps(self, stop):
+        try:
+            beat_timestamps = self.get_beat_timestamps()
+        except Exception as error:
+            print("Could not analyse", self.music_file, ":", error)
+            if not stop.is_set():
+                self.loading_state = 'failed'
+            return
+        if not stop.is_set():
+            self.beat_timestamps = beat_timestamps
+            self.loading_state = 'ready'
+
+    def stream_beat_timestamps(self, stop):
+        # Enemies start spawning from the first beats found, the list grows while the music plays
+        beat_timestamps = self.beat_timestamps
+        try:
+            for beats in music_analysis.stream_beats(self.music_file):
+                if stop.is_set():
+                    return
+                beat_timestamps.extend(beats)
+        except Exception as error:
+            # Streaming needs a decoder able to seek in the file, fall back to the full analysis
+            print("Could not stream", self.music_file, ":", error)
+            if not stop.is_set():
+                self.loading_state = 'loading'
+                self.load_beat_timestamps(stop)
+            return
+        if not stop.is_set():
+            self.loading_state = 'ready'
+
+    def loading_screen(self):
+        dots = "." * (pygame.time.get_ticks() // 300 % 4)
+        frame = ('loading', self.music_file, dots)
+        if frame != self.last_frame:
+            screen.fill((0, 0, 0))
+            display_text(f"Loading {os.path.basename(self.music_file)}{dots}", WIDTH // 4, HEIGHT // 2, WHITE)
+            pygame.display.flip()
+            self.last_frame = frame
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                exit()
+        self.clock.tick(30)
+
+    def run_summary(self):
+        # Results of the run, with the columns of the players' CSV files
         average_reaction_time = sum(self.reaction_times) / len(self.reaction_times) if self.reaction_times else 0
-        with open(player_file, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            # Write header if the file is new or empty
-            if not file_exists or os.path.getsize(player_file) == 0:
-                writer.writerow(['Name', 'Score', 'Total Blocks', 'Just in Time', 'Normal', 'Too Early',
-                                 'Up', 'Down', 'Left', 'Right', 'Start Time', 'End Time', 'Duration', 'Music','Average Reaction Time'])
-            duration = (self.end_time - self.start_time).total_seconds()
-            writer.writerow([
-                self.name,
-                self.score,
-                self.block_counts['total'],
-                self.block_counts['just_in_time'],
-                self.block_counts['normal'],
-                self.block_counts['too_early'],
-                self.blocks_per_direction['up'],
-                self.blocks_per_direction['down'],
-                self.blocks_per_direction['left'],
-                self.blocks_per_direction['right'],
-                self.start_time.strftime("%Y-%m-%d %H:%M:%S"),
-                self.end_time.strftime("%Y-%m-%d %H:%M:%S"),
-                duration,
-                os.path.basename(self.music_file),  # Save the music name
-                average_reaction_time
-            ])
-        # Update the main leaderboard
-        file_exists = os.path.isfile(self.leaderboard_file)
-        with open(self.leaderboard_file, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            if not file_exists or os.path.getsize(self.leaderboard_file) == 0:
-                writer.writerow(['Name', 'Score', 'Date','Music'])
-            writer.writerow([self.name, self.score, self.end_time.strftime("%Y-%m-%d %H:%M:%S"),os.path.basename(self.music_file)])
+        return {
+            'name': self.name,
+            'score': self.score,
+            'total_blocks': self.block_counts['total'],
+            'just_in_time': self.block_counts['just_in_time'],
+            'normal': self.block_counts['normal'],
+            'too_early': self.block_counts['too_early'],
+            'up': self.blocks_per_direction['up'],
+            'down': self.blocks_per_direction['down'],
+            'left': self.blocks_per_direction['left'],
+            'right': self.blocks_per_direction['right'],
+            'start_time': self.start_time.strftime("%Y-%m-%d %H:%M:%S"),
+            'end_time': self.end_time.strftime("%Y-%m-%d %H:%M:%S"),
+            'duration': (self.end_time - self.start_time).total_seconds(),
+            'music': os.path.basename(self.music_file),  # Save the music name
+            'average_reaction_time': average_reaction_time,
+        }
 
     def load_leaderboard(self):
-        leaderboard_data = []
-        try:
-            with open(self.leaderboard_file, mode='r') as file:
-                reader = csv.reader(file)
-                next(reader)  # Skip header
-                leaderboard_data = sorted([row for row in reader], key=lambda x: int(x[1]), reverse=True)
-            return leaderboard_data[:5]
-        except (FileNotFoundError, StopIteration):
+        # Top 5 of every booth from the leaderboard server, as last fetched in the background
+        if self.leaderboard is not None:
+            rows = self.leaderboard.top(5)
+            if rows is not None:
+                return rows
+        # Top 5 from the results store, cached there until a new run is saved
+        if self.results is None:
             return []
+        return self.results.top(5)
 
-    def leaderboard_screen(self):
-        screen.fill((0, 0, 0))
-        display_text("Leaderboard", WIDTH // 2 - 80, 50, WHITE)
+    def draw_leaderboard(self):
         leaderboard_data = self.load_leaderboard()
-        y_offset = 100
-        for entry in leaderboard_data:
-            display_text(f"{entry[0]}: {entry[1]} - {entry[2]} - on music: {entry[3]}", WIDTH // 20, y_offset, WHITE)
-            y_offset += 40
-        display_text("Press ENTER to play", WIDTH // 4, HEIGHT - 100, WHITE)
-        pygame.display.flip()
+        frame = ('leaderboard', tuple(tuple(entry) for entry in leaderboard_data))
+        if frame != self.last_frame:
+            screen.fill((0, 0, 0))
+            display_text("Leaderboard", WIDTH // 2 - 80, 50, WHITE)
+            y_offset = 100
+            for entry in leaderboard_data:
+                display_text(f"{entry[0]}: {entry[1]} - {entry[2]} - on music: {entry[3]}", WIDTH // 20, y_offset, WHITE)
+                y_offset += 40
+            display_text("Press ENTER to play", WIDTH // 4, HEIGHT - 100, WHITE)
+            pygame.display.flip()
+            self.last_frame = frame
+
+    def leaderboard_screen(self):
+        self.draw_leaderboard()
 
         # Event handling to move to music selection screen
-        for event in pygame.event.get():
+        for event in wait_events():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 exit()
@@ -271,12 +494,15 @@ class Game:
     def name_input_screen(self):
         self.name = ""
         while True:
-            screen.fill((0, 0, 0))
-            display_text("Enter your name: " + self.name, WIDTH // 4, HEIGHT // 3, WHITE)
-            display_text("Press ENTER to start", WIDTH // 4, HEIGHT // 2, WHITE)
-            pygame.display.flip()
-
-            for event in pygame.event.get():
+            frame = ('name_input', self.name)
+            if frame != self.last_frame:
+                screen.fill((0, 0, 0))
+                display_text("Enter your name: " + self.name, WIDTH // 4, HEIGHT // 3, WHITE)
+                display_text("Press ENTER to start", WIDTH // 4, HEIGHT // 2, WHITE)
+                pygame.display.flip()
+                self.last_frame = frame
+
+            for event in wait_events():
                 if event.type == pygame.QUIT:
                     pygame.quit()
                     exit()
@@ -287,15 +513,18 @@ class Game:
                         self.name = self.name[:-1]
                     elif len(self.name) < 10 and event.unicode.isalnum():
                         self.name += event.unicode
-            clock.tick(30)
+            self.clock.tick(30)
 
     def game_over_screen(self):
-        screen.fill((0, 0, 0))
-        display_text(f"Game Over! Score: {self.score}", WIDTH // 4, HEIGHT // 3, WHITE)
-        display_text("Press ENTER to return to the main menu", WIDTH // 4, HEIGHT // 2, WHITE)
-        pygame.display.flip()
+        frame = ('game_over', self.score)
+        if frame != self.last_frame:
+            screen.fill((0, 0, 0))
+            display_text(f"Game Over! Score: {self.score}", WIDTH // 4, HEIGHT // 3, WHITE)
+            display_text("Press ENTER to return to the main menu", WIDTH // 4, HEIGHT // 2, WHITE)
+            pygame.display.flip()
+            self.last_frame = frame
 
-        for event in pygame.event.get():
+        for event in wait_events():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 exit()
@@ -304,58 +533,117 @@ class Game:
         return 'game_over'
 
     def pause_screen(self):
-        pygame.mixer.music.pause()  # Pause the music
+        self.music.pause()  # Pause the music
+        screen.fill((0, 0, 0))
+        display_text("Game Paused", WIDTH // 2 - 80, HEIGHT // 2 - 20, WHITE)
+        display_text("Press 'P' to resume", WIDTH // 2 - 150, HEIGHT // 2 + 20, WHITE)
+        pygame.display.flip()
         while self.game_paused:
-            screen.fill((0, 0, 0))
-            display_text("Game Paused", WIDTH // 2 - 80, HEIGHT // 2 - 20, WHITE)
-            display_text("Press 'P' to resume", WIDTH // 2 - 150, HEIGHT // 2 + 20, WHITE)
-            pygame.display.flip()
-            for event in pygame.event.get():
+            for event in wait_events():
                 if event.type == pygame.QUIT:
                     pygame.quit()
                     exit()
                 if event.type == pygame.KEYDOWN and event.key == pygame.K_p:
                     self.game_paused = False
-                    pygame.mixer.music.unpause()  # Resume the music
-            clock.tick(30)
+                    self.music.unpause()  # Resume the music
+        # Forget the controller presses made during the pause
+        self.serial_reader.drain()
+        # The pause screen covered the game, redraw all of it
+        self.renderer.invalidate()
+
+    def log_event(self, event, **fields):
+        # Journal record of the current run, written by the journal thread
+        if self.session_id is not None:
+            fields['event'] = event
+            self.journal.log(self.session_id, fields)
 
     def check_game_over(self):
-        for enemy in self.enemies:
-            if enemy.active:
-                distance = ((self.player.x - enemy.x) ** 2 + (self.player.y - enemy.y) ** 2) ** 0.5
-                if distance < self.player.size:  # If an enemy touches the player
-                    return True
-        return False
-
-    def check_defense(self, player_input):
-        current_time = pygame.time.get_ticks()
-        for enemy in self.enemies:
-            if enemy.active and enemy.direction == player_input:
-                distance = ((self.player.x - enemy.x) ** 2 + (self.player.y - enemy.y) ** 2) ** 0.5
-                if distance < 200:  # Seuil pour pouvoir toucher les zombies
-                    enemy.active = False
-                    self.death_marks.append({'x': enemy.x, 'y': enemy.y, 'start_time': pygame.time.get_ticks()})
-                    reaction_time = current_time - enemy.spawn_time  # Calcul du temps de réaction
-                    self.reaction_times.append(reaction_time)  # Nouvelle liste pour stocker les temps de réaction
-
-                    self.score += int(20 / (distance*0.02))
-                    self.block_counts['total'] += 1
-                    self.blocks_per_direction[player_input] += 1
-                    if distance < 50:
-                        self.block_counts['just_in_time'] += 1
-                    elif distance < 125:
-                        self.block_counts['normal'] += 1
-                    else:
-                        self.block_counts['too_early'] += 1
-
-    def read_serial_input(self):
-        if ser and ser.in_waiting:
-            line = ser.readline().decode('utf-8').strip()
-            if line in ['UP', 'DOWN', 'LEFT', 'RIGHT']:
-                return line.lower()
-        return None
+        # If an enemy touches the player
+        distances = self.enemies.distances(self.player)
+        touching = np.flatnonzero(distances < self.player.size)
+        if not len(touching):
+            return False
+        self.events.record('miss', self.simulated_time, self.enemies.beat[touching], self.enemies.direction[touching],
+                           distances[touching], self.simulated_time - self.enemies.spawn_time[touching],
+                           self.speed_multiplier)
+        return True
+
+    def check_defense(self, player_input, current_time):
+        # current_time: game time of the input, reaction times are measured in game time like the spawn times
+        distances = self.enemies.distances(self.player)
+        direction = DIRECTIONS.index(player_input)
+        same_direction = self.enemies.direction == direction
+        hits = np.flatnonzero(same_direction & (distances < 200))  # Seuil pour pouvoir toucher les zombies
+        if not len(hits):
+            # Whiff: keep the closest zombie in that direction (if any) and the last beat spawned
+            closest = distances[same_direction].min(initial=np.inf)
+            self.events.record('whiff', current_time, [self.enemy_spawn_index - 1], direction,
+                               closest if closest < np.inf else np.nan, np.nan, self.speed_multiplier)
+            return 0
+        # Handle the hits in spawn order, like the original enemy list
+        hits = hits[np.argsort(self.enemies.spawn_time[hits], kind='stable')]
+        hit_distances = distances[hits]
+        for slot in hits:
+            self.death_marks.append({'x': self.enemies.x[slot], 'y': self.enemies.y[slot], 'start_time': self.ticks()})
+        # Calcul du temps de réaction
+        reaction_times = current_time - self.enemies.spawn_time[hits]
+        self.events.record('hit', current_time, self.enemies.beat[hits], direction, hit_distances, reaction_times,
+                           self.speed_multiplier)
+        reaction_times = reaction_times.tolist()
+        self.reaction_times.extend(reaction_times)
+        self.enemies.kill(hits)
+
+        hit_scores = (20 / (hit_distances * 0.02)).astype(int)
+        self.score += int(hit_scores.sum())
+        if self.session_id is not None:
+            for distance, reaction_time, hit_score in zip(hit_distances.tolist(), reaction_times, hit_scores.tolist()):
+                distance_class = 'just_in_time' if distance < 50 else 'normal' if distance < 125 else 'too_early'
+                self.log_event('hit', time=current_time, direction=player_input, distance=distance,
+                               distance_class=distance_class, reaction_time=reaction_time, score=hit_score)
+        self.block_counts['total'] += len(hits)
+        self.blocks_per_direction[player_input] += len(hits)
+        self.block_counts['just_in_time'] += int((hit_distances < 50).sum())
+        self.block_counts['normal'] += int(((hit_distances >= 50) & (hit_distances < 125)).sum())
+        self.block_counts['too_early'] += int((hit_distances >= 125).sum())
+        return len(hits)
+
+    def read_serial_inputs(self):
+        # Every press received by the serial thread since the last frame, stamped in game time
+        return [(self.audio_clock.time_at(counter), direction, 'serial', counter)
+                for counter, direction in self.serial_reader.drain()]
+
+    def apply_inputs(self, until=None):
+        # The inputs of a replay are handled at the same simulation step as in the recorded run
+        while self.scripted_inputs and self.scripted_inputs[0][0] <= self.simulated_time:
+            _, input_time, direction = self.scripted_inputs.popleft()
+            self.handle_input(input_time, direction, 'replay', time.perf_counter())
+        # Defend against the pending inputs received before 'until' (all of them if None), in order
+        while self.pending_inputs and (until is None or self.pending_inputs[0][0] < until):
+            self.handle_input(*self.pending_inputs.pop(0))
+
+    def handle_input(self, input_time, direction, source, counter):
+        self.input_log.append((self.simulated_time, input_time, DIRECTIONS.index(direction)))
+        self.defense_direction = direction
+        hits = self.check_defense(direction, input_time)
+        self.stats.record_input(source, counter, hits)
 
     def game_loop(self):
+        if not self.start_run():
+            return 'select_music'
+        while True:
+            next_screen = self.run_frame()
+            if next_screen:
+                return next_screen
+
+    def start_run(self, beat_timestamps=None, start_music=True, seed=None):
+        """Reset the game and start the music. The beats are loaded (or streamed) unless given.
+
+        With start_music=False the music is already playing, started by the
+        station mode for all its games (see stations.py). seed: seed of the
+        zombie directions, drawn from self.rng if None (given by the replays).
+        """
+        self.seed = self.rng.getrandbits(32) if seed is None else seed
+        self.spawn_rng.seed(self.seed)
         self.score = 0
         self.enemies.clear()
         self.death_marks.clear()
@@ -364,142 +652,336 @@ class Game:
         self.music_started = False
         self.enemy_spawn_index = 0
         self.speed_multiplier = 1.0
+        self.simulated_time = 0.0
+        self.pending_inputs = []
+        self.input_log = []
+        self.spawn_log = []
+        self.reaction_times = []
+        self.events.clear()
         self.block_counts = {'total': 0, 'just_in_time': 0, 'normal': 0, 'too_early': 0}
         self.blocks_per_direction = {'up': 0, 'down': 0, 'left': 0, 'right': 0}
+
+        # Sprites and background image, loaded for the first run (the menus don't need them)
+        if self.player_image is None:
+            self.load_sprites()
+        if self.background is None:
+            self.background = self.load_game_background("background.png")
+        self.renderer = DirtyRenderer(self.surface, self.background, self.viewport)
+
+        if start_music:
+            # The music is decoded in a background thread too, the first time it is played
+            self.music.prepare(self.music_file)
+        if beat_timestamps is not None:
+            self.beat_timestamps = beat_timestamps
+            self.beats_streamed = False
+            self.loading_state = 'ready'
+        else:
+            # Load beats in a separate thread, the window keeps responding meanwhile
+            self.start_beat_loading()
+        while self.beats_loading() or (start_music and not self.music.ready(self.music_file)):
+            self.loading_screen()
+        if self.loading_state == 'failed':
+            return False
         self.start_time = datetime.now()
+        if self.save_results:
+            self.session_id = self.journal.begin_session(self.name, os.path.basename(self.music_file), self.start_time)
+        # The game draws over the menus, they will need a full redraw afterwards
+        self.last_frame = None
+
+        # Start the music, it drives the game time
+        if start_music:
+            self.music.load(self.music_file)
+            self.music.play()
+        self.music_length = self.music.get_length()
+        self.audio_clock.reset()
+        self.stats.reset()
+        return True
+
+    def run_frame(self, events=None):
+        """Handle the inputs, simulate and draw one frame. Returns 'game_over' when the run is over.
+
+        events: the pygame events of this frame, read from the queue if None.
+        """
+        self.stats.begin_frame()
+        if not self.music_started:
+            if self.music.get_busy():
+                self.music_started = True
+
+        # Game time of this frame, the inputs read now are stamped with it
+        game_time = self.audio_clock.update()
+
+        # Event handling
+        for event in pygame.event.get() if events is None else events:
+            if event.type == pygame.QUIT:
+                self.music.stop()
+                pygame.quit()
+                exit()
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_p:
+                    self.game_paused = True
+                    self.pause_screen()
+                    game_time = self.audio_clock.update()
+                elif event.key == pygame.K_F3:
+                    self.show_perf_overlay = not self.show_perf_overlay
+                elif event.key in self.key_directions:  # Arrows or ZQSD
+                    self.pending_inputs.append((game_time, self.key_directions[event.key], 'keyboard', time.perf_counter()))
+            elif event.type == pygame.KEYUP and event.key in self.key_directions:
+                self.defense_direction = None
+
+        # Read serial input, stamped with their arrival time by the serial thread
+        self.pending_inputs.extend(self.read_serial_inputs())
+        if self.bot:
+            counter = time.perf_counter()
+            self.pending_inputs.extend((game_time, direction, 'bot', counter) for direction in self.bot(self))
+        self.pending_inputs.sort(key=lambda pending: pending[0])
+        self.stats.mark('events')
+
+        # Advance the simulation up to the music position
+        if self.advance(game_time):
+            self.stats.end_frame()
+            return self.finish_run()
+
+        # Drawing, only the regions that changed since the last frame are updated
+        self.renderer.begin()
+
+        # Player sprite already rotated for the defense_direction (default angle otherwise)
+        rotated_player_image = self.player_images.get(self.defense_direction, self.player_image)
+        player_rect = rotated_player_image.get_rect(center=(self.player.x, self.player.y))
+        self.renderer.blit(rotated_player_image, player_rect)
+
+        # Enemies are drawn between their last two simulated positions
+        alpha = min(max((game_time - self.simulated_time) / SIMULATION_STEP_MS, 0.0), 1.0)
+        self.enemies.draw(self.renderer, self.enemy_images, alpha)
+        # Draw explosion animations
+        current_time = self.ticks()
+        for mark in self.death_marks[:]:
+            elapsed_time = current_time - mark['start_time']
+            frame_duration = 60  # Duration of each frame in ms
+            frame_index = elapsed_time // frame_duration
+            if frame_index < len(self.explosion_frames):
+                frame = self.explosion_frames[int(frame_index)]
+                rect = frame.get_rect(center=(mark['x'], mark['y']))
+                self.renderer.blit(frame, rect)
+            else:
+                self.death_marks.remove(mark)
+
+        self.renderer.blit(render_text(f"Score: {self.score}"), (10, 10))
+        if self.show_perf_overlay:
+            self.draw_perf_overlay()
+        self.stats.mark('draw')
+        self.renderer.end()
+        self.stats.mark('flip')
+        self.clock.tick(RENDER_FPS)
+        self.stats.mark('idle')
+        self.stats.end_frame()
+        return None
 
-        # Load background image
-        self.background_image, self.bg_position = self.load_and_center_background("background.png")
+    def advance(self, game_time, max_steps=MAX_STEPS_PER_FRAME):
+        """Simulate the fixed steps up to game_time, max_steps at most. Returns True on game over.
 
-        # Load beats in a separate thread
-        beat_thread = threading.Thread(target=lambda: setattr(self, 'beat_timestamps', self.get_beat_timestamps()))
-        beat_thread.start()
-        beat_thread.join()
+        Each input is handled at the step during which it arrived.
+        """
+        steps = 0
+        while self.simulated_time + SIMULATION_STEP_MS <= game_time and steps < max_steps:
+            self.apply_inputs(until=self.simulated_time + SIMULATION_STEP_MS)
+            self.stats.mark('collision')
+            self.simulated_time += SIMULATION_STEP_MS
+            self.simulation_step()
+            steps += 1
+            self.stats.mark('update')
 
-        # Start the music
-        pygame.mixer.music.load(self.music_file)
-        pygame.mixer.music.play()
+            # Check for Game Over
+            game_over = self.check_game_over()
+            self.stats.mark('collision')
+            if game_over:
+                return True
+        if steps < max_steps:
+            self.apply_inputs()
+            self.stats.mark('collision')
+        return False
 
-        running = True
-        while running:
-            if not self.music_started:
-                if pygame.mixer.music.get_busy():
-                    self.music_started = True
+    def finish_run(self):
+        if self.owns_music:
+            self.music.stop()
+            self.beat_loader_stop.set()
+        self.end_time = datetime.now()
+        if self.save_results:
+            # Saved by the journal thread, the game over screen does not wait for the disk
+            exports = [partial(save_trace, self.trace_file(), self.stats.snapshot()),
+                       partial(save_trace, self.trace_file('.replay.npz'), self.replay_snapshot()),
+                       partial(save_events, os.path.join(EVENTS_DIR, self.session_id), self.events.snapshot(),
+                               self.session_id, self.name, os.path.basename(self.music_file), DIRECTIONS)]
+            self.journal.end_session(self.session_id, self.run_summary(), exports)
+            self.session_id = None
+        return 'game_over'
 
-            # Event handling
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.mixer.music.stop()
-                    pygame.quit()
-                    exit()
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_p:
-                        self.game_paused = True
-                        self.pause_screen()
-                    elif event.key in (pygame.K_UP, pygame.K_z):  # Up arrow or Z
-                        self.defense_direction = 'up'
-                        self.check_defense(self.defense_direction)
-                    elif event.key in (pygame.K_DOWN, pygame.K_s):  # Down arrow or S
-                        self.defense_direction = 'down'
-                        self.check_defense(self.defense_direction)
-                    elif event.key in (pygame.K_LEFT, pygame.K_q):  # Left arrow or Q
-                        self.defense_direction = 'left'
-                        self.check_defense(self.defense_direction)
-                    elif event.key in (pygame.K_RIGHT, pygame.K_d):  # Right arrow or D
-                        self.defense_direction = 'right'
-                        self.check_defense(self.defense_direction)
-                elif event.type == pygame.KEYUP:
-                    self.defense_direction = None
-
-            # Read serial input
-            serial_input = self.read_serial_input()
-            if serial_input:
-                self.defense_direction = serial_input
-                self.check_defense(self.defense_direction)
-
-            # Enemy spawning based on beats
-            current_time_ms = pygame.mixer.music.get_pos()
-            while self.enemy_spawn_index < len(self.beat_timestamps) and current_time_ms >= self.beat_timestamps[self.enemy_spawn_index]:
-                direction = random.choice(['up', 'down', 'left', 'right'])
-                enemy = Enemy(direction, speed=5, image=self.enemy_image)
-                self.enemies.append(enemy)
+    def draw_perf_overlay(self):
+        # The percentiles are only computed twice per second
+        if self.stats.frame_count % 30 == 0 or not self.perf_text:
+            fps, p50, p99 = self.stats.summary()
+            self.perf_text = f"{fps:.0f} FPS  p50 {p50:.1f} ms  p99 {p99:.1f} ms"
+        text = render_text(self.perf_text)
+        self.renderer.blit(text, (WIDTH - text.get_width() - 10, 10))
+
+    def trace_file(self, extension='.trace.npz'):
+        # Frame timings and input latencies of the run (or its replay), next to the player's CSV file
+        return os.path.join('players', f"{self.name}_{self.start_time.strftime('%Y%m%d-%H%M%S')}{extension}")
+
+    def replay_snapshot(self):
+        # Everything needed to play the run again (see replay.py), saved like the trace
+        inputs = np.array(self.input_log, dtype=np.float64).reshape(-1, 3)
+        spawns = np.array(self.spawn_log, dtype=np.float64).reshape(-1, 2)
+        return {
+            'version': REPLAY_VERSION,
+            'name': self.name,
+            'start_time': self.start_time.strftime("%Y-%m-%d %H:%M:%S"),
+            'music': os.path.basename(self.music_file),
+            'track': beat_cache.file_hash(self.music_file),
+            'music_length': self.music_length,
+            # The zombies as they spawned (the beats may have been streamed, then switched to the full beat map)
+            'spawn_steps': spawns[:, 0],  # Simulated time of the step the zombie spawned at
+            'spawn_beats': spawns[:, 1].astype(np.int32),
+            'seed': self.seed,
+            'input_steps': inputs[:, 0],  # Simulated time of the step the input was handled at
+            'input_times': inputs[:, 1],
+            'input_directions': inputs[:, 2].astype(np.int8),  # Index in DIRECTIONS
+            'end_time': self.simulated_time,
+            'score': self.score,
+        }
+
+    def simulation_step(self):
+        source = self.beat_source
+        if source is not self:
+            # Station mode: follow the beats of the first station, they grow while streamed
+            # (and are replaced by the full analysis if streaming fails)
+            self.beat_timestamps = source.beat_timestamps
+        # The music loops by itself, a new loop starts exactly one music length after the previous one
+        loop_time = self.simulated_time - self.audio_clock.loop_offset
+        if loop_time >= self.music_length > 0:
+            # Switch from the streamed beats to the full beat map once it is cached
+            if source.beats_streamed and source.loading_state == 'ready':
+                self.beat_timestamps = beat_cache.load_beats(self.music_file) or self.beat_timestamps
+            self.speed_multiplier += 0.2  # Increase speed by 10% each loop
+            self.score+=1000
+            self.enemy_spawn_index = 0
+            self.audio_clock.new_loop(self.music_length)
+            loop_time -= self.music_length
+            self.log_event('loop', time=self.simulated_time, speed_multiplier=self.speed_multiplier, bonus=1000)
+
+        # Enemy spawning based on beats (beat times are relative to the current loop of the music)
+        beats = []
+        if self.scripted_spawns is not None:
+            # A replay spawns the zombies at the steps they spawned in the recorded run
+            while self.scripted_spawns and self.scripted_spawns[0][0] <= self.simulated_time:
+                beats.append(self.scripted_spawns.popleft()[1])
+                # The whiffs record the last beat spawned, like in the recorded run
+                self.enemy_spawn_index = beats[-1] + 1
+        else:
+            while self.enemy_spawn_index < len(self.beat_timestamps) and loop_time >= self.beat_timestamps[self.enemy_spawn_index]:
+                beats.append(self.enemy_spawn_index)
                 self.enemy_spawn_index += 1
+        for beat in beats:
+            direction = self.spawn_rng.choice(DIRECTIONS)
+            self.enemies.spawn(direction, speed=5, spawn_time=self.simulated_time, beat=beat)
+            self.spawn_log.append((self.simulated_time, beat))
+            self.log_event('spawn', time=self.simulated_time, direction=direction)
 
-            # Check if the music has ended
-            if not pygame.mixer.music.get_busy():
-                # Restart the music and increase the speed
-                pygame.mixer.music.load(self.music_file)
-                pygame.mixer.music.play()
-                self.speed_multiplier += 0.2  # Increase speed by 10% each loop
-                self.score+=1000
-                self.enemy_spawn_index = 0
-
-            # Update enemies
-            for enemy in self.enemies:
-                if enemy.active:
-                    enemy.update(self.player, self.speed_multiplier)
-
-            # Check for Game Over
-            if self.check_game_over():
-                pygame.mixer.music.stop()
-                self.end_time = datetime.now()
-                self.save_score_csv()
-                return 'game_over'
-
-            # Drawing
-            screen.fill((0, 0, 0))
-            screen.blit(self.background_image, self.bg_position)
-
-            # Rotate the player sprite based on defense_direction
-            if self.defense_direction:
-                angle = self.get_angle_from_direction(self.defense_direction)
-            else:
-                angle = 0  # Default angle
-            rotated_player_image = pygame.transform.rotate(self.player_image, angle)
-            player_rect = rotated_player_image.get_rect(center=(self.player.x, self.player.y))
-            screen.blit(rotated_player_image, player_rect)
-
-            for enemy in self.enemies:
-                if enemy.active:
-                    enemy.draw(screen)
-            # Draw explosion animations
-            current_time = pygame.time.get_ticks()
-            for mark in self.death_marks[:]:
-                elapsed_time = current_time - mark['start_time']
-                frame_duration = 60  # Duration of each frame in ms
-                frame_index = elapsed_time // frame_duration
-                if frame_index < len(self.explosion_frames):
-                    frame = self.explosion_frames[int(frame_index)]
-                    rect = frame.get_rect(center=(mark['x'], mark['y']))
-                    screen.blit(frame, rect)
-                else:
-                    self.death_marks.remove(mark)
-
-            display_text(f"Score: {self.score}", 10, 10)
-            pygame.display.flip()
-            clock.tick(60)
+        # Update enemies
+        self.enemies.update(self.player, self.speed_multiplier)
 
     def get_angle_from_direction(self, direction):
-        if direction == 'up':
-            return 90
-        elif direction == 'right':
-            return 0
-        elif direction == 'down':
-            return -90
-        elif direction == 'left':
-            return 180
+        return PLAYER_ANGLES.get(direction)
 
 # --- Utility Functions ---
 
+def list_explosion_files():
+    # Obtenir la liste des fichiers d'explosion dans le dossier 'sprites'
+    explosion_files = [f for f in os.listdir('sprites') if f.endswith('.png') and '-explosion' in f]
+    # Trier les fichiers par ordre numérique
+    explosion_files.sort()
+    return explosion_files
+
+def sprite_specs():
+    """(name, path, size, angles) of every sprite drawn in game, baked by asset_bundle.py."""
+    player_angles = sorted({0} | set(PLAYER_ANGLES.values()))
+    specs = [
+        ('player', 'sprites/player.png', (30, 40), player_angles),  # Adjust size as needed
+        ('enemy', 'sprites/enemy.png', (60, 60), [ENEMY_ANGLES[direction] for direction in DIRECTIONS]),
+    ]
+    # Redimensionner les frames d'explosion si nécessaire
+    specs += [(filename, os.path.join('sprites', filename), (60, 60), [0]) for filename in list_explosion_files()]
+    return specs
+
+def init_pygame(headless=False, size=(WIDTH, HEIGHT)):
+    global screen, FONT
+    if headless:
+        # No window and no sound card needed
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    # The decoded tracks of the audio cache are in this format
+    pygame.mixer.pre_init(audio_cache.FREQUENCY, -16, audio_cache.CHANNELS)
+    pygame.init()
+    screen = pygame.display.set_mode(size)
+    pygame.display.set_caption("Rhythm Game: Directional Defense")
+    FONT = pygame.font.Font(None, 36)
+
+# Rendered text surfaces, reused as long as the text doesn't change
+text_cache = {}
+
+def render_text(text, color=WHITE):
+    surface = text_cache.get((text, color))
+    if surface is None:
+        if len(text_cache) > 512:
+            text_cache.clear()
+        surface = text_cache[(text, color)] = FONT.render(text, True, color)
+    return surface
+
 def display_text(text, x, y, color=WHITE):
-    surface = FONT.render(text, True, color)
-    screen.blit(surface, (x, y))
+    screen.blit(render_text(text, color), (x, y))
+
+def wait_events(timeout=MENU_IDLE_MS):
+    # Sleep until an event arrives (or the timeout), so the menus don't use the CPU while idle
+    event = pygame.event.wait(timeout)
+    events = [] if event.type == pygame.NOEVENT else [event]
+    return events + pygame.event.get()
 
 # --- Main Execution ---
 
 def main():
+    parser = argparse.ArgumentParser(description="Rhythm Game: Directional Defense")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print the time spent in each phase of the start, until the leaderboard is shown')
+    parser.add_argument('--leaderboard', default=LEADERBOARD_URL, metavar='URL',
+                        help='leaderboard server shared by the booths (see leaderboard_server.py)')
+    args = parser.parse_args()
+    profile = StartupProfile(IMPORT_START)
+    profile.mark('imports')
+
+    init_pygame()
+    profile.mark('pygame init')
     game = Game()
+    profile.mark('game')
+    game.results = ResultsStore()
+    game.results.import_csv_once(leaderboard_file=game.leaderboard_file)
+    profile.mark('results store')
+    # Write the runs in the background, the runs interrupted last time are saved first
+    game.journal.results = game.results
+    if args.leaderboard:
+        game.leaderboard = game.journal.leaderboard = LeaderboardClient(args.leaderboard)
+        game.leaderboard.start()
+    game.journal.start()
+    # Read the Arduino controller in the background, it can be plugged in at any time
+    game.serial_reader.start()
+    profile.mark('threads')
+    game.draw_leaderboard()
+    profile.mark('leaderboard')
+
+    # Everything else starts once the leaderboard is on screen
     game.load_music_list()
+    game.start_analysis()
+    profile.mark('music analysis')
+    if args.profile_startup:
+        profile.report()
     current_screen = 'leaderboard'
 
     while True: